@@ -1,5 +1,6 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
 
@@ -8,19 +9,134 @@ class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     DEBUG: bool = True
+    # Uvicorn worker processes; above 1 they share documents, job status, the
+    # LLM concurrency limit and metrics through SHARED_STATE_PATH
+    WORKERS: int = 1
+    # SQLite database the workers share; must be on a local disk
+    SHARED_STATE_PATH: str = ".readly_state.db"
+    # How often each worker publishes its metrics and running jobs' progress
+    METRICS_SYNC_INTERVAL_SECONDS: float = 5.0
+    JOB_SYNC_INTERVAL_SECONDS: float = 1.0
+    # How often a caller waiting for an LLM slot held by another worker re-checks
+    LLM_SLOT_POLL_SECONDS: float = 0.1
 
     # CORS settings
     ALLOWED_ORIGINS: List[str] = ["*"]
 
     # Ollama settings
     OLLAMA_BASE_URL: str = "http://localhost:11434"
+    # Ollama hosts to balance across: URLs or {"url", "models", "weight",
+    # "max_in_flight"} objects. Empty uses OLLAMA_BASE_URL alone.
+    OLLAMA_BACKENDS: List[Union[str, Dict[str, Any]]] = []
     OLLAMA_MODEL: str = "mistral"
     OLLAMA_TIMEOUT: int = 60
+    OLLAMA_NUM_CTX: int = 4096
+    OLLAMA_NUM_PREDICT: int = 2048
+    # Structured output: "schema" (JSON schema), "json" or "" to disable
+    OLLAMA_FORMAT: str = "schema"
+    OLLAMA_CONNECT_TIMEOUT: float = 5.0
+    OLLAMA_MAX_CONNECTIONS: int = 10
+    OLLAMA_MAX_KEEPALIVE_CONNECTIONS: int = 5
+    HEALTH_PROBE_INTERVAL_SECONDS: float = 15.0
+    # How long Ollama keeps the model loaded after a request ("30m", "-1" = forever)
+    OLLAMA_KEEP_ALIVE: str = "30m"
+    # Ping interval that keeps the model resident; 0 disables keep-warm pings
+    KEEP_WARM_INTERVAL_SECONDS: float = 240.0
+    # Local hours "start-end" (e.g. "8-18") to keep warm in; empty is all day
+    KEEP_WARM_HOURS: str = ""
+    # Consecutive failures before generations fail fast with 503
+    CIRCUIT_FAILURE_THRESHOLD: int = 3
+    CIRCUIT_RESET_SECONDS: float = 30.0
 
     # Processing settings
+    MAX_UPLOAD_BYTES: int = 100 * 1024 * 1024
+    PDF_EXTRACT_WORKERS: int = 4
+    PDF_PARALLEL_PAGE_THRESHOLD: int = 200
     MAX_CHUNKS: int = 3
-    MAX_TOKENS_PER_CHUNK: int = 1500
+    # Chunk maps per page of GET /documents/{document_id}/maps
+    MAP_PAGE_SIZE: int = 3
+    # How MAX_CHUNKS chunks are picked from a document: "tfidf" or "embeddings"
+    # (Ollama OLLAMA_EMBED_MODEL) for representative, non-redundant chunks, or
+    # "first" for the leading chunks
+    CHUNK_SELECTION: str = "tfidf"
+    # Max-marginal-relevance trade-off: 0 favours central chunks, 1 favours variety
+    CHUNK_SELECTION_DIVERSITY: float = 0.5
+    OLLAMA_EMBED_MODEL: str = "nomic-embed-text"
+    # None sizes chunks to fill OLLAMA_NUM_CTX after the knowledge map prompt
+    # and the response (knowledge_service.chunk_token_budget); PDFService
+    # called without a budget subtracts only the response
+    MAX_TOKENS_PER_CHUNK: Optional[int] = None
+    CHUNK_OVERLAP_TOKENS: int = 0
+    # "approximate" or "huggingface" (requires the tokenizers package)
+    TOKEN_COUNTER: str = "approximate"
+    TOKENIZER_NAME: str = "mistralai/Mistral-7B-Instruct-v0.2"
+    # Map-reduce mode (upload with summarize=true): every chunk is summarized,
+    # then summaries are merged in context-sized groups into one topic tree
+    SUMMARY_MAX_TOKENS: int = 512
+    SUMMARY_MAX_SUBTOPICS: int = 12
     MAX_RETRIES: int = 3
+    RETRY_BACKOFF_BASE_SECONDS: float = 0.5
+    RETRY_BACKOFF_MAX_SECONDS: float = 8.0
+    UPLOAD_CHUNK_CONCURRENCY: int = 4
+    # Default cap on concurrent generations per Ollama backend
+    LLM_MAX_CONCURRENCY: int = 4
+    # Slots of that cap background work (question bank fills) leaves free
+    BACKGROUND_RESERVED_SLOTS: int = 1
+    # Concurrent generations with the same model, prompt and options share one call
+    LLM_COALESCE_ENABLED: bool = True
+
+    # "orjson" uses orjson for JSON decode/encode when it is installed, "std" never does
+    JSON_BACKEND: str = "orjson"
+
+    # Background job settings
+    JOB_WORKERS: int = 2
+    JOB_MAX_QUEUE_DEPTH: int = 20
+    JOB_RETRY_AFTER_SECONDS: int = 30
+    JOB_RESULT_TTL_SECONDS: int = 3600
+
+    # Question bank: questions pre-generated per subtopic after an upload and
+    # refilled in the background once fewer than QUESTION_BANK_LOW_WATER remain
+    QUESTION_BANK_ENABLED: bool = True
+    QUESTION_BANK_SIZE: int = 9
+    QUESTION_BANK_LOW_WATER: int = 3
+    QUESTION_BANK_MAX_SUBTOPICS: int = 1000
+
+    # Document store settings
+    DOCUMENT_TTL_SECONDS: int = 3600
+    DOCUMENT_MAX_ENTRIES: int = 100
+    DOCUMENT_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # Cache settings
+    CACHE_ENABLED: bool = True
+    CACHE_DIR: str = ".readly_cache"
+    CACHE_MEMORY_ENTRIES: int = 512
+    # Serialized size of all values held in memory; larger values stay on disk
+    CACHE_MEMORY_MAX_BYTES: int = 64 * 1024 * 1024
+    CACHE_DISK_MAX_BYTES: int = 256 * 1024 * 1024
+
+    @field_validator("KEEP_WARM_HOURS")
+    @classmethod
+    def _check_keep_warm_hours(cls, value: str) -> str:
+        """Fail at startup rather than in the keep-warm loop"""
+        if not value.strip():
+            return ""
+        parts = value.split("-")
+        if len(parts) != 2 or not all(part.strip().isdigit() for part in parts):
+            raise ValueError(f'expected "start-end" hours like "8-18", got {value!r}')
+        start, end = (int(part) for part in parts)
+        if start > 23 or end > 24 or start == end:
+            raise ValueError(
+                f"expected different hours, start 0-23 and end 0-24, got {value!r}"
+            )
+        return f"{start}-{end}"
+
+    @property
+    def keep_warm_hours(self) -> Optional[Tuple[int, int]]:
+        """KEEP_WARM_HOURS as (start, end), or None for all day"""
+        if not self.KEEP_WARM_HOURS:
+            return None
+        start, end = self.KEEP_WARM_HOURS.split("-")
+        return int(start), int(end)
 
     class Config:
         env_file = ".env"
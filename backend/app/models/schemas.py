@@ -1,6 +1,6 @@
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class QuizQuestion(BaseModel):
@@ -23,21 +23,115 @@ class KnowledgeMap(BaseModel):
     subtopics: List[Subtopic]
 
 
+class SummarySection(BaseModel):
+    title: str
+    summary: str
+    key_concepts: List[str]
+
+
+class DocumentSummary(BaseModel):
+    topic: str
+    sections: List[SummarySection]
+
+
 class QuestionGenerationRequest(BaseModel):
     title: str
     description: str
     key_concepts: List[str]
-    num_questions: Optional[int] = 3
+    num_questions: int = Field(3, ge=1)
+    document_id: Optional[str] = None
+    chunk_index: Optional[int] = None
 
 
 class QuestionResponse(BaseModel):
     questions: List[QuizQuestion]
 
 
+class SubtopicQuestionRequest(BaseModel):
+    title: str
+    description: str
+    key_concepts: List[str]
+    existing_questions: List[str] = []
+    chunk_index: Optional[int] = None
+
+
+class BatchQuestionGenerationRequest(BaseModel):
+    subtopics: List[SubtopicQuestionRequest] = []
+    knowledge_map: Optional[KnowledgeMap] = None
+    num_questions: int = Field(3, ge=1)
+    document_id: Optional[str] = None
+
+
+class SubtopicQuestions(BaseModel):
+    title: str
+    questions: List[QuizQuestion]
+    error: Optional[str] = None
+
+
+class BatchQuestionResponse(BaseModel):
+    results: List[SubtopicQuestions]
+    prompts_used: int
+
+
 class UploadResponse(BaseModel):
-    maps: List[str]
+    maps: List[KnowledgeMap]
     message: str
     chunks_processed: int
+    document_id: Optional[str] = None
+    chunks_reused: int = 0
+    # All chunks of the document; maps of those not processed yet are
+    # generated on demand by GET /documents/{document_id}/maps
+    chunks_total: int = 0
+
+
+class ChunkMap(BaseModel):
+    chunk: int
+    # None when no valid map could be generated; requesting the page retries
+    map: Optional[KnowledgeMap] = None
+
+
+class DocumentMapsPage(BaseModel):
+    document_id: str
+    chunks_total: int
+    maps: List[ChunkMap]
+    # Pass as cursor to get the following page; None after the last chunk
+    next_cursor: Optional[str] = None
+
+
+class UploadStreamEvent(BaseModel):
+    event: str
+    message: Optional[str] = None
+    pages: Optional[int] = None
+    # Position among the total_chunks chunks this upload processes
+    chunk: Optional[int] = None
+    # Index of that chunk in the document, as used by /documents/{id}/maps
+    chunk_index: Optional[int] = None
+    total_chunks: Optional[int] = None
+    map: Optional[KnowledgeMap] = None
+    result: Optional[UploadResponse] = None
+
+
+class ChunkProgress(BaseModel):
+    # Position among the job's chunks_total chunks
+    chunk: int
+    # Index of that chunk in the document, as used by /documents/{id}/maps
+    chunk_index: int
+    status: str
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    priority: int
+    queue_position: Optional[int] = None
+    chunks_total: int
+    chunks_completed: int
+    chunks: List[ChunkProgress]
+    result: Optional[UploadResponse] = None
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
 
 
 class TestResponse(BaseModel):
@@ -51,4 +145,6 @@ class HealthResponse(BaseModel):
     status: str
     ollama_available: bool
     model_loaded: bool
+    circuit_state: str = "closed"
+    checked_at: Optional[str] = None
     timestamp: str
@@ -0,0 +1,63 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from ..config import settings
+from ..models.schemas import ChunkMap, DocumentMapsPage
+from ..services.document_store import document_store
+from ..services.map_pager import map_pager
+from ..services.ollama_service import ollama_service
+
+router = APIRouter()
+
+# Largest page a client may request
+MAX_PAGE_SIZE = 20
+
+
+def _decode_cursor(cursor: Optional[str], chunks: int) -> int:
+    """Chunk index a cursor points at; no cursor starts at the first chunk"""
+    if cursor is None:
+        return 0
+    if not cursor.isdigit() or int(cursor) >= chunks:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return int(cursor)
+
+
+@router.get("/documents/{document_id}/maps", response_model=DocumentMapsPage)
+async def get_document_maps(
+    document_id: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    prefetch: bool = True,
+):
+    """Knowledge maps of a document's chunks in document order, a page at a time
+
+    Maps not generated yet, including those of chunks the upload did not
+    select, are generated now and kept for later requests. Pass next_cursor
+    from the response to get the following page. With prefetch the following
+    page is generated in the background while this one is read.
+    """
+    document = await document_store.get(document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    start = _decode_cursor(cursor, len(document.chunks))
+    limit = limit or settings.MAP_PAGE_SIZE
+
+    if None in document.maps[start : start + limit]:
+        ollama_service.raise_if_unavailable()
+    maps = await map_pager.page(document, start, limit)
+
+    stop = start + len(maps)
+    next_cursor = str(stop) if stop < len(document.chunks) else None
+    if prefetch and next_cursor is not None:
+        map_pager.prefetch(document, stop, limit)
+
+    return DocumentMapsPage(
+        document_id=document_id,
+        chunks_total=len(document.chunks),
+        maps=[
+            ChunkMap(chunk=index, map=knowledge_map)
+            for index, knowledge_map in enumerate(maps, start)
+        ],
+        next_cursor=next_cursor,
+    )
@@ -1,9 +1,14 @@
 from datetime import datetime
 
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
 
 from ..models.schemas import HealthResponse, TestResponse
+from ..services.cache_service import cache_service
+from ..services.metrics_service import registry
 from ..services.ollama_service import ollama_service
+from ..services.question_bank import question_bank
+from ..services.shared_state import shared_state
 
 router = APIRouter()
 
@@ -11,18 +16,65 @@ router = APIRouter()
 @router.get("/test-ollama", response_model=TestResponse)
 async def test_ollama():
     """Test endpoint to check Ollama performance"""
-    result = ollama_service.test_connection()
+    result = await ollama_service.test_connection()
     return TestResponse(**result)
 
 
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Comprehensive health check endpoint"""
-    ollama_available = ollama_service.check_status()
+    """Health check served from the background prober's cached status
+
+    Reports "warming" while the startup preload is still running.
+    """
+    status = ollama_service.status
+    circuit_state = ollama_service.circuit_state()
+    healthy = status["model_available"] and circuit_state == "closed"
+    checked_at = status["checked_at"]
+    if ollama_service.warming:
+        overall = "warming"
+    else:
+        overall = "healthy" if healthy else "degraded"
 
     return HealthResponse(
-        status="healthy" if ollama_available else "degraded",
-        ollama_available=ollama_available,
-        model_loaded=ollama_available,  # Simplified check
+        status=overall,
+        ollama_available=status["ollama_available"],
+        model_loaded=status["model_available"],
+        circuit_state=circuit_state,
+        checked_at=checked_at.isoformat() if checked_at else None,
         timestamp=datetime.utcnow().isoformat(),
     )
+
+
+@router.get("/backends")
+async def backend_stats():
+    """Per-backend health, load and latency of the Ollama pool"""
+    return await ollama_service.get_backend_stats()
+
+
+@router.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss counters and size of the result cache"""
+    return cache_service.get_stats()
+
+
+@router.get("/question-bank-stats")
+async def question_bank_stats():
+    """Banked question counts, pending refills and bank hit/miss counters"""
+    return question_bank.get_stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency, token throughput, retry and cache metrics in Prometheus text format
+
+    With several workers the values are summed over all of them, as of each
+    worker's last publish (every METRICS_SYNC_INTERVAL_SECONDS).
+    """
+    if shared_state.enabled:
+        snapshots = await shared_state.metrics_snapshots()
+        text = registry.render(snapshots + [registry.snapshot()])
+    else:
+        text = registry.render()
+    return PlainTextResponse(
+        text, media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, HTTPException
+
+from ..models.schemas import JobStatus
+from ..services.job_service import job_queue
+
+router = APIRouter()
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """Report per-chunk progress and, once finished, the result of an upload job"""
+    status = await job_queue.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@router.delete("/jobs/{job_id}", response_model=JobStatus)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running upload job"""
+    status = await job_queue.cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
@@ -1,37 +1,137 @@
-import json
 import time
 
 from fastapi import APIRouter, HTTPException
 
-from ..models.schemas import QuestionGenerationRequest, QuestionResponse
+from ..models.schemas import (
+    BatchQuestionGenerationRequest,
+    BatchQuestionResponse,
+    QuestionGenerationRequest,
+    QuestionResponse,
+    SubtopicQuestionRequest,
+    SubtopicQuestions,
+)
+from ..services.document_store import document_store
 from ..services.knowledge_service import knowledge_service
-from ..utils.validators import validate_questions
+from ..services.ollama_service import ollama_service
+from ..services.question_bank import question_bank
+from ..utils.validators import ResponseValidationError
 
 router = APIRouter()
 
 
 @router.post("/generate-questions", response_model=QuestionResponse)
 async def generate_additional_questions(request: QuestionGenerationRequest):
-    """Generate additional quiz questions for a specific subtopic"""
+    """Generate additional quiz questions for a specific subtopic
+
+    Served from the question bank when it holds enough questions; otherwise
+    generated now, and the bank is refilled in the background either way.
+    """
+    key = question_bank.key(request.document_id, request.title)
+    banked = question_bank.take(key, request.num_questions)
+    if banked is not None:
+        print(f"Served {len(banked)} banked questions for: {request.title}")
+        return QuestionResponse(questions=banked)
+
+    ollama_service.raise_if_unavailable()
     start_time = time.time()
 
     print(f"Generating {request.num_questions} questions for: {request.title}")
 
-    questions_json = knowledge_service.generate_additional_questions(
-        request.title, request.description, request.key_concepts, request.num_questions
+    source_text = None
+    if request.document_id:
+        document = await document_store.get(request.document_id)
+        if document is None:
+            raise HTTPException(status_code=404, detail="Document not found")
+        chunk_index = request.chunk_index
+        if chunk_index is None:
+            chunk_index = document.find_chunk(request.title)
+        if chunk_index is not None:
+            if not 0 <= chunk_index < len(document.chunks):
+                raise HTTPException(status_code=400, detail="Invalid chunk index")
+            source_text = document.chunks[chunk_index]
+
+    try:
+        questions = await knowledge_service.generate_additional_questions(
+            request.title,
+            request.description,
+            request.key_concepts,
+            request.num_questions,
+            source_text,
+        )
+    except ResponseValidationError as e:
+        print("Generated questions are invalid (missing explanations or malformed)")
+        raise HTTPException(status_code=500, detail=e.to_detail())
+    finally:
+        generation_time = time.time() - start_time
+        print(f"Question generation took {generation_time:.2f} seconds")
+
+    question_bank.register(
+        key,
+        SubtopicQuestionRequest(
+            title=request.title,
+            description=request.description,
+            key_concepts=request.key_concepts,
+        ),
+        source_text,
+        served=questions,
     )
+    return QuestionResponse(questions=questions)
+
+
+@router.post("/generate-questions/batch", response_model=BatchQuestionResponse)
+async def generate_question_batch(request: BatchQuestionGenerationRequest):
+    """Generate quiz questions for several subtopics in as few prompts as possible"""
+    ollama_service.raise_if_unavailable()
+    start_time = time.time()
+
+    subtopics = list(request.subtopics)
+    if request.knowledge_map is not None:
+        subtopics.extend(
+            SubtopicQuestionRequest(
+                title=sub.title,
+                description=sub.description,
+                key_concepts=sub.key_concepts,
+                existing_questions=[q.question for q in sub.quiz],
+            )
+            for sub in request.knowledge_map.subtopics
+        )
+    if not subtopics:
+        raise HTTPException(status_code=400, detail="No subtopics provided")
 
-    generation_time = time.time() - start_time
-    print(f"Question generation took {generation_time:.2f} seconds")
+    sources = [None] * len(subtopics)
+    if request.document_id:
+        document = await document_store.get(request.document_id)
+        if document is None:
+            raise HTTPException(status_code=404, detail="Document not found")
+        for i, sub in enumerate(subtopics):
+            chunk_index = sub.chunk_index
+            if chunk_index is None:
+                chunk_index = document.find_chunk(sub.title)
+            if chunk_index is not None:
+                if not 0 <= chunk_index < len(document.chunks):
+                    raise HTTPException(status_code=400, detail="Invalid chunk index")
+                sources[i] = document.chunks[chunk_index]
 
-    if validate_questions(questions_json):
-        try:
-            questions = json.loads(questions_json)
-            return QuestionResponse(questions=questions)
-        except json.JSONDecodeError:
-            raise HTTPException(
-                status_code=500, detail="Invalid JSON response from AI model"
+    print(
+        f"Generating {request.num_questions} questions each for "
+        f"{len(subtopics)} subtopics"
+    )
+    try:
+        results, prompts_used = await knowledge_service.generate_question_batch(
+            subtopics, request.num_questions, sources
+        )
+    finally:
+        generation_time = time.time() - start_time
+        print(f"Batch question generation took {generation_time:.2f} seconds")
+
+    return BatchQuestionResponse(
+        results=[
+            SubtopicQuestions(
+                title=sub.title,
+                questions=questions or [],
+                error=None if questions is not None else "Question generation failed",
             )
-    else:
-        print("Generated questions are invalid (missing explanations or malformed)")
-        raise HTTPException(status_code=500, detail="Generated questions are invalid")
+            for sub, questions in zip(subtopics, results)
+        ],
+        prompts_used=prompts_used,
+    )
@@ -1,51 +1,324 @@
+import asyncio
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
 from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from ..config import settings
-from ..models.schemas import UploadResponse
+from ..models.schemas import (
+    JobStatus,
+    KnowledgeMap,
+    UploadResponse,
+    UploadStreamEvent,
+)
+from ..services.document_store import Document, document_store
+from ..services.job_service import QueueFullError, job_queue
 from ..services.knowledge_service import knowledge_service
-from ..services.pdf_service import pdf_service
-from ..utils.validators import validate_knowledge_map
+from ..services.metrics_service import STAGE_SECONDS
+from ..services.ollama_service import ollama_service
+from ..services.pdf_service import UploadTooLargeError, pdf_service
+from ..services.question_bank import question_bank
+from ..services.selection_service import selection_service
+from ..services.version_store import version_store
+from ..utils.resilience import CircuitOpenError
 
 router = APIRouter()
 
-# Global variable to store uploaded file content
-uploaded_file_content = ""
-
 
-@router.post("/upload", response_model=UploadResponse)
-async def upload_pdf(file: UploadFile = File(...)):
-    """Upload and process a PDF file to generate knowledge maps"""
-    global uploaded_file_content
+async def _extract_document(
+    file: UploadFile, select: bool = True
+) -> Tuple[int, Document]:
+    """Extract and chunk an uploaded PDF, registering it in the document store
 
+    Every chunk is registered. With select, only MAX_CHUNKS representative
+    chunks are marked for generation now; maps of the others are generated
+    on demand through GET /documents/{document_id}/maps. When the same file
+    was processed before, chunk boundaries are re-aligned with the previous
+    version and maps of unchanged chunks are reused.
+    """
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
 
     try:
-        # Extract text from PDF
-        uploaded_file_content = await pdf_service.extract_text_from_pdf(file)
+        spooled = await pdf_service.spool_upload(file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    previous = version_store.previous(file.filename)
+    page_hashes: List[str] = []
+    loop = asyncio.get_running_loop()
+
+    def extract_and_chunk() -> List[Tuple[str, str]]:
+        """Chunk pages in a worker thread as their ranges finish extracting"""
+        ranges = pdf_service.iter_page_ranges(spooled)
+        pages = pdf_service.iter_pages_blocking(ranges, loop)
+
+        def fingerprinted() -> Iterator[str]:
+            for page in pages:
+                page_hashes.append(version_store.fingerprint(page))
+                yield page
+
+        return list(
+            pdf_service.iter_chunks(
+                fingerprinted(),
+                knowledge_service.chunk_token_budget(),
+                anchors=previous.anchors if previous else None,
+            )
+        )
+
+    # Overlaps extraction, so this stage includes waiting on pages
+    with spooled, STAGE_SECONDS.time(stage="chunk"):
+        chunked = await asyncio.to_thread(extract_and_chunk)
+    page_count = len(page_hashes)
+    chunks = [chunk for chunk, _ in chunked]
+
+    if not chunks:
+        raise HTTPException(status_code=400, detail="No text content found in PDF")
+
+    document = document_store.create(file.filename, spooled.content_hash, chunks)
+    if select:
+        # The upload's LLM budget stays at MAX_CHUNKS maps, spread over the
+        # whole document
+        with STAGE_SECONDS.time(stage="chunk_selection"):
+            document.selected = await selection_service.select(
+                chunks, settings.MAX_CHUNKS
+            )
+        if len(chunks) > len(document.selected):
+            print(f"Selected chunks {document.selected} of {len(chunks)}")
+
+    document.page_hashes = page_hashes
+    document.anchors = [anchor for _, anchor in chunked]
+    if previous is not None and select:
+        reused = version_store.reuse_maps(document, previous)
+        document.reused_maps = sum(
+            document.maps[i] is not None for i in document.selected
+        )
+        changed = version_store.changed_pages(previous, document.page_hashes)
+        print(
+            f"Previous version found: {changed} pages changed, "
+            f"reusing {reused} of {len(chunks)} maps"
+        )
+    document_store.update(document)
+    return page_count, document
+
+
+async def generate_chunk_maps(document: Document) -> List[KnowledgeMap]:
+    """Generate knowledge maps for the selected chunks concurrently, preserving order"""
+    selected = document.selected
+
+    def on_chunk(position: int, knowledge_map: Optional[KnowledgeMap]) -> None:
+        document_store.set_map(document.document_id, selected[position], knowledge_map)
+
+    results = await knowledge_service.generate_knowledge_maps(
+        document.selected_chunks(),
+        on_chunk,
+        [document.maps[i] for i in selected],
+    )
+    version_store.save(document)
+    question_bank.fill_document(document)
+    return [m for m in results if m is not None]
+
 
-        if not uploaded_file_content.strip():
-            raise HTTPException(status_code=400, detail="No text content found in PDF")
+async def _stream_chunk_map(
+    document: Document,
+    position: int,
+    total: int,
+    semaphore: asyncio.Semaphore,
+    events: asyncio.Queue,
+) -> None:
+    """Stream the map of the position-th selected chunk, reporting progress on the event queue"""
+    index = document.selected[position]
+    knowledge_map = document.maps[index]
+    if knowledge_map is not None:
+        # Unchanged since the previous version of the document
+        await events.put(
+            UploadStreamEvent(
+                event="map",
+                chunk=position,
+                chunk_index=index,
+                total_chunks=total,
+                map=knowledge_map,
+            )
+        )
+        return
+
+    async with semaphore:
+        await events.put(
+            UploadStreamEvent(
+                event="chunk_started",
+                chunk=position,
+                chunk_index=index,
+                total_chunks=total,
+            )
+        )
+        try:
+            knowledge_map = await knowledge_service.generate_knowledge_map(
+                document.chunks[index]
+            )
+        except Exception as e:
+            # Any failure is reported, so the client can tell a chunk is missing
+            print(f"Skipping chunk {index + 1}: {e}")
+            await events.put(
+                UploadStreamEvent(
+                    event="chunk_failed",
+                    chunk=position,
+                    chunk_index=index,
+                    total_chunks=total,
+                    message=str(e),
+                )
+            )
+            return
+
+    document_store.set_map(document.document_id, index, knowledge_map)
+    await events.put(
+        UploadStreamEvent(
+            event="map",
+            chunk=position,
+            chunk_index=index,
+            total_chunks=total,
+            map=knowledge_map,
+        )
+    )
 
-        # Split into chunks
-        chunks = pdf_service.chunk_text(uploaded_file_content)
-        chunks_to_process = chunks[: settings.MAX_CHUNKS]
 
-        knowledge_maps = []
-        for i, chunk in enumerate(chunks_to_process):
-            print(f"Processing chunk {i+1}/{len(chunks_to_process)}")
-            map_json = knowledge_service.generate_knowledge_map(chunk)
+async def _stream_upload_events(
+    page_count: int, document: Document
+) -> AsyncIterator[str]:
+    """Yield NDJSON progress events and knowledge maps as each chunk finishes"""
+    total = len(document.selected)
+    yield UploadStreamEvent(
+        event="extracted", pages=page_count, message=f"Extracted {page_count} pages"
+    ).model_dump_json(exclude_none=True) + "\n"
+    yield UploadStreamEvent(
+        event="chunked", total_chunks=total, message=f"Processing {total} chunks"
+    ).model_dump_json(exclude_none=True) + "\n"
 
-            if validate_knowledge_map(map_json):
-                knowledge_maps.append(map_json)
-            else:
-                print(f"Skipping invalid map for chunk {i+1}")
+    events: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(settings.UPLOAD_CHUNK_CONCURRENCY)
+
+    async def run_chunks():
+        await asyncio.gather(
+            *(
+                _stream_chunk_map(document, i, total, semaphore, events)
+                for i in range(total)
+            ),
+            return_exceptions=True,
+        )
+        await events.put(None)
+
+    runner = asyncio.create_task(run_chunks())
+    # Chunk index -> map, so the final result keeps the original chunk order
+    maps = {}
+
+    try:
+        while (event := await events.get()) is not None:
+            if event.event == "map":
+                maps[event.chunk] = event.map
+            yield event.model_dump_json(exclude_none=True) + "\n"
+
+        knowledge_maps = [maps[i] for i in sorted(maps)]
+        version_store.save(document)
+        question_bank.fill_document(document)
+        result = UploadResponse(
+            maps=knowledge_maps,
+            message=f"Successfully processed {len(knowledge_maps)} knowledge maps",
+            chunks_processed=total,
+            document_id=document.document_id,
+            chunks_reused=document.reused_maps,
+            chunks_total=len(document.chunks),
+        )
+        yield UploadStreamEvent(event="done", result=result).model_dump_json(
+            exclude_none=True
+        ) + "\n"
+    finally:
+        # Stops outstanding chunks if the client disconnects mid-stream
+        runner.cancel()
+
+
+def _queue_full(error: QueueFullError) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many queued uploads, try again later",
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+@router.post(
+    "/upload",
+    response_model=UploadResponse,
+    responses={202: {"model": JobStatus}, 429: {"description": "Job queue is full"}},
+)
+async def upload_pdf(
+    file: UploadFile = File(...),
+    background: bool = False,
+    priority: int = 0,
+    summarize: bool = False,
+):
+    """Upload and process a PDF file to generate knowledge maps
+
+    With background=true the maps are generated by a queued job and the job
+    status is returned immediately; poll GET /api/v1/jobs/{job_id} for results.
+    With summarize=true the whole document is summarized into a single
+    knowledge map instead of one map per selected chunk.
+    """
+    ollama_service.raise_if_unavailable()
+    try:
+        if background:
+            # Checked before the upload is processed, and again on submit
+            try:
+                job_queue.raise_if_full()
+            except QueueFullError as e:
+                raise _queue_full(e)
+
+        _, document = await _extract_document(file, select=not summarize)
+
+        if background:
+            try:
+                job = job_queue.submit(document, priority, summarize)
+            except QueueFullError as e:
+                document_store.delete(document.document_id)
+                raise _queue_full(e)
+            return JSONResponse(
+                status_code=202,
+                content=job.to_status(job_queue.queue_position(job)).model_dump(),
+            )
+
+        if summarize:
+            knowledge_maps = [
+                await knowledge_service.generate_document_map(document.chunks)
+            ]
+            version_store.save(document)
+            question_bank.fill_document(document, knowledge_maps)
+        else:
+            knowledge_maps = await generate_chunk_maps(document)
 
         return UploadResponse(
             maps=knowledge_maps,
             message=f"Successfully processed {len(knowledge_maps)} knowledge maps",
-            chunks_processed=len(chunks_to_process),
+            chunks_processed=len(document.selected),
+            document_id=document.document_id,
+            chunks_reused=document.reused_maps,
+            chunks_total=len(document.chunks),
         )
 
+    except (HTTPException, CircuitOpenError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+
+
+@router.post("/upload/stream")
+async def upload_pdf_stream(file: UploadFile = File(...)):
+    """Upload a PDF and stream progress events and knowledge maps as NDJSON"""
+    ollama_service.raise_if_unavailable()
+    try:
+        page_count, document = await _extract_document(file)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+
+    return StreamingResponse(
+        _stream_upload_events(page_count, document),
+        media_type="application/x-ndjson",
+    )
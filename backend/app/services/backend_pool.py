@@ -0,0 +1,346 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator, List, Optional, Union
+
+import httpx
+
+from ..config import settings
+from ..utils.resilience import CircuitBreaker, CircuitOpenError
+from ..services.shared_state import shared_state
+
+# Number of recent request latencies kept per backend for percentiles
+LATENCY_WINDOW = 256
+
+# Set while running work that should only use capacity interactive requests
+# leave idle; inherited by tasks created inside the block
+_background: ContextVar[bool] = ContextVar("background_priority", default=False)
+
+
+@contextmanager
+def background_priority() -> Iterator[None]:
+    """Run the generations made inside the block at background priority"""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+def _return_lease(lease: asyncio.Future) -> None:
+    """Release a shared slot leased for a caller that was cancelled meanwhile"""
+    if (
+        not lease.cancelled()
+        and lease.exception() is None
+        and lease.result() is not None
+    ):
+        shared_state.release_slot(lease.result())
+
+
+class SharedPriority:
+    """Priority of a generation several callers share: the highest of theirs
+
+    Starts at the priority of the caller that starts the generation, and
+    join() raises it when an interactive caller joins.
+    """
+
+    def __init__(self):
+        self.background = _background.get()
+
+    def join(self) -> None:
+        """Called from each caller that joins the generation"""
+        if not _background.get():
+            self.background = False
+
+
+class OllamaBackend:
+    """One Ollama host with its own connections, in-flight cap and circuit breaker"""
+
+    def __init__(
+        self,
+        url: str,
+        models: Optional[List[str]] = None,
+        weight: float = 1.0,
+        max_in_flight: Optional[int] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.url = url.rstrip("/")
+        # None serves whatever model is requested
+        self.models = models
+        self.weight = weight
+        self.max_in_flight = max_in_flight or settings.LLM_MAX_CONCURRENCY
+        self.in_flight = 0
+        self.breaker = CircuitBreaker(name=f"Ollama {self.url}")
+        # Last result of the background prober
+        self.status = {
+            "ollama_available": False,
+            "model_available": False,
+            "checked_at": None,
+        }
+        self.requests = 0
+        self.failures = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """HTTP client for this backend, created lazily so it binds to the running loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                timeout=httpx.Timeout(
+                    settings.OLLAMA_TIMEOUT, connect=settings.OLLAMA_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+                transport=self._transport,
+            )
+        return self._client
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or any(model in m for m in self.models)
+
+    def record(self, status_code: Optional[int], latency: float) -> None:
+        """Feed the outcome of a generation call to the stats and circuit breaker"""
+        self.requests += 1
+        if status_code is None or status_code >= 500:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self._latencies.append(latency)
+            self.breaker.record_success()
+
+    def mean_latency(self) -> float:
+        if not self._latencies:
+            return 0.0
+        return sum(self._latencies) / len(self._latencies)
+
+    def get_stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        checked_at = self.status["checked_at"]
+        return {
+            "url": self.url,
+            "models": self.models,
+            "weight": self.weight,
+            "circuit_state": self.breaker.state,
+            "ollama_available": self.status["ollama_available"],
+            "model_available": self.status["model_available"],
+            "checked_at": checked_at.isoformat() if checked_at else None,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_mean": self.mean_latency() if latencies else None,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+        }
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class BackendPool:
+    """Routes each generation to the least loaded healthy backend serving the model
+
+    Load is outstanding requests divided by weight, ties broken by mean
+    latency. A backend whose circuit is open is ejected until its half-open
+    trial call succeeds. When every eligible backend is at its in-flight cap
+    callers wait for a slot.
+
+    Background-priority callers never wait ahead of interactive ones and
+    leave BACKGROUND_RESERVED_SLOTS of each backend's cap free for them.
+    With several workers the caps are global: a slot is also leased in the
+    shared state, and callers poll for slots other workers hold.
+    """
+
+    def __init__(self, backends: List[OllamaBackend]):
+        self.backends = backends
+        self._slots = asyncio.Condition()
+        self._interactive_waiting = 0
+
+    @classmethod
+    def from_settings(cls) -> "BackendPool":
+        """Build from OLLAMA_BACKENDS, falling back to OLLAMA_BASE_URL"""
+        return cls(
+            [_backend_from_config(entry) for entry in settings.OLLAMA_BACKENDS]
+            or [OllamaBackend(settings.OLLAMA_BASE_URL)]
+        )
+
+    def serving(self, model: str) -> List[OllamaBackend]:
+        return [b for b in self.backends if b.serves(model)]
+
+    def _eligible(self, model: str) -> List[OllamaBackend]:
+        return [b for b in self.serving(model) if b.breaker.available()]
+
+    def _unavailable(self, model: str) -> CircuitOpenError:
+        retry_after = min(
+            (b.breaker.retry_after() for b in self.serving(model)),
+            default=int(settings.CIRCUIT_RESET_SECONDS),
+        )
+        return CircuitOpenError(retry_after)
+
+    def raise_if_unavailable(self, model: str) -> None:
+        """Fail fast when no backend for the model could take a request"""
+        if not self._eligible(model):
+            raise self._unavailable(model)
+
+    def circuit_state(self, model: str) -> str:
+        """Best circuit state among the backends serving the model"""
+        states = {b.breaker.state for b in self.serving(model)}
+        for state in ("closed", "half_open"):
+            if state in states:
+                return state
+        return "open"
+
+    @asynccontextmanager
+    async def acquire(
+        self, model: str, priority: Optional[SharedPriority] = None
+    ) -> AsyncIterator[OllamaBackend]:
+        """Reserve an in-flight slot on the best backend for the model
+
+        A shared generation passes its priority, which replaces the caller's.
+        Raises CircuitOpenError when every backend serving the model is ejected.
+        """
+
+        def in_background() -> bool:
+            return priority.background if priority else _background.get()
+
+        background = in_background()
+        if not background:
+            self._interactive_waiting += 1
+        # Backends whose shared slots other workers held at the last try
+        full = set()
+        try:
+            while True:
+                async with self._slots:
+                    while True:
+                        if background and not in_background():
+                            # Joined by an interactive caller while waiting
+                            background = False
+                            self._interactive_waiting += 1
+                        eligible = self._eligible(model)
+                        if not eligible:
+                            raise self._unavailable(model)
+                        free = [
+                            b
+                            for b in eligible
+                            if b.in_flight < self._cap(b, background)
+                        ]
+                        ranked = self._rank([b for b in free if b.url not in full])
+                        if ranked:
+                            break
+                        if not free and not background:
+                            await self._slots.wait()
+                            continue
+                        # Held by other workers, whose releases do not notify
+                        # us, or a background wait a joining caller may promote
+                        try:
+                            await asyncio.wait_for(
+                                self._slots.wait(), settings.LLM_SLOT_POLL_SECONDS
+                            )
+                        except asyncio.TimeoutError:
+                            pass
+                        full.clear()
+                    backend = ranked[0]
+                    # Counted before the lease is taken, so concurrent callers
+                    # in this worker see the slot as used
+                    backend.in_flight += 1
+                if not shared_state.enabled:
+                    slot_id = None
+                    break
+                try:
+                    slot_id = await self._lease(backend, background)
+                except BaseException:
+                    await self._release(backend, None)
+                    raise
+                if slot_id is not None:
+                    break
+                full.add(backend.url)
+                await self._release(backend, None)
+        finally:
+            if not background:
+                self._interactive_waiting -= 1
+                # Background callers may be waiting for the queue to drain
+                async with self._slots:
+                    self._slots.notify_all()
+        try:
+            backend.breaker.check()
+        except CircuitOpenError:
+            await self._release(backend, slot_id)
+            raise
+        try:
+            yield backend
+        finally:
+            backend.breaker.release()
+            await self._release(backend, slot_id)
+
+    @staticmethod
+    def _rank(free: List[OllamaBackend]) -> List[OllamaBackend]:
+        """Free backends, least loaded first"""
+        return sorted(
+            free, key=lambda b: ((b.in_flight + 1) / b.weight, b.mean_latency())
+        )
+
+    async def _lease(self, backend: OllamaBackend, background: bool) -> Optional[int]:
+        """Lease a shared slot on backend off the event loop; None when all are held"""
+        lease = asyncio.ensure_future(
+            asyncio.to_thread(
+                shared_state.try_acquire_slot,
+                backend.url,
+                self._cap(backend, background),
+            )
+        )
+        try:
+            return await asyncio.shield(lease)
+        except asyncio.CancelledError:
+            # The lease may still be granted; hand it straight back
+            lease.add_done_callback(_return_lease)
+            raise
+
+    async def _release(self, backend: OllamaBackend, slot_id: Optional[int]) -> None:
+        backend.in_flight -= 1
+        if slot_id is not None:
+            shared_state.release_slot(slot_id)
+        async with self._slots:
+            self._slots.notify_all()
+
+    def _cap(self, backend: OllamaBackend, background: bool) -> int:
+        if not background:
+            return backend.max_in_flight
+        if self._interactive_waiting:
+            return 0
+        return max(1, backend.max_in_flight - settings.BACKGROUND_RESERVED_SLOTS)
+
+    async def close(self) -> None:
+        await asyncio.gather(*(b.close() for b in self.backends))
+
+    async def get_stats(self) -> List[dict]:
+        stats = [b.get_stats() for b in self.backends]
+        if shared_state.enabled:
+            in_use = await shared_state.slots_in_use()
+            for entry in stats:
+                entry["global_in_flight"] = in_use.get(entry["url"], 0)
+        return stats
+
+
+def _backend_from_config(entry: Union[str, dict]) -> OllamaBackend:
+    if isinstance(entry, str):
+        return OllamaBackend(entry)
+    return OllamaBackend(
+        entry["url"],
+        models=entry.get("models"),
+        weight=entry.get("weight", 1.0),
+        max_in_flight=entry.get("max_in_flight"),
+    )
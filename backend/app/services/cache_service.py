@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from ..config import settings
+from ..utils import json_backend
+from ..services.metrics_service import CACHE_LOOKUPS
+
+
+def content_hash(*parts: Any) -> str:
+    """Stable SHA-256 fingerprint of the given parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(json.dumps(part, sort_keys=True).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CacheService:
+    """Two-tier content-addressed cache: in-memory LRU backed by an on-disk store"""
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        memory_entries: int = None,
+        memory_max_bytes: int = None,
+        disk_max_bytes: int = None,
+        enabled: bool = None,
+    ):
+        self.cache_dir = cache_dir or settings.CACHE_DIR
+        self.memory_entries = memory_entries or settings.CACHE_MEMORY_ENTRIES
+        self.memory_max_bytes = memory_max_bytes or settings.CACHE_MEMORY_MAX_BYTES
+        self.disk_max_bytes = disk_max_bytes or settings.CACHE_DISK_MAX_BYTES
+        self.enabled = settings.CACHE_ENABLED if enabled is None else enabled
+
+        # Key -> (value, serialized size)
+        self._memory: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if self.enabled and self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def key(self, namespace: str, *parts: Any) -> str:
+        return f"{namespace}-{content_hash(*parts)}"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Look up a value, promoting disk hits into the memory tier"""
+        if not self.enabled:
+            return None
+        namespace = key.split("-", 1)[0]
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            CACHE_LOOKUPS.inc(namespace=namespace, result="memory_hit")
+            return self._memory[key][0]
+
+        value, size = self._read_disk(key)
+        if value is not None:
+            self.stats["disk_hits"] += 1
+            CACHE_LOOKUPS.inc(namespace=namespace, result="disk_hit")
+            self._remember(key, value, size)
+            return value
+
+        self.stats["misses"] += 1
+        CACHE_LOOKUPS.inc(namespace=namespace, result="miss")
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value in both tiers"""
+        if not self.enabled:
+            return
+        data = json_backend.dumps_bytes(value)
+        self._remember(key, value, len(data))
+        self._write_disk(key, data)
+
+    def clear(self) -> None:
+        self._memory.clear()
+        self._memory_bytes = 0
+        for path, _, _ in self._disk_entries():
+            os.remove(path)
+        self._disk_bytes = 0
+
+    def get_stats(self) -> dict:
+        lookups = (
+            self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        )
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def _remember(self, key: str, value: Any, size: int) -> None:
+        """Hold a value in memory, evicting least recently used ones over the caps"""
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        if size > self.memory_max_bytes:
+            # Too large to keep in memory; served from disk only
+            return
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while (
+            len(self._memory) > self.memory_entries
+            or self._memory_bytes > self.memory_max_bytes
+        ):
+            self._memory_bytes -= self._memory.popitem(last=False)[1][1]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Tuple[Optional[Any], int]:
+        """Value stored on disk for key and its serialized size"""
+        if not self.cache_dir:
+            return None, 0
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            value = json_backend.loads(data)
+            # Touch so eviction treats the entry as recently used
+            os.utime(path)
+            return value, len(data)
+        except FileNotFoundError:
+            return None, 0
+        except (OSError, ValueError) as e:
+            print(f"Discarding unreadable cache entry {key}: {e}")
+            return None, 0
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(data) - previous
+        except OSError as e:
+            print(f"Failed to write cache entry {key}: {e}")
+            return
+        self._evict_disk()
+
+    def _disk_entries(self):
+        """(path, mtime, size) for every entry in the disk tier"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict_disk(self) -> None:
+        """Remove least recently used disk entries until under the size cap"""
+        if self._disk_bytes <= self.disk_max_bytes:
+            return
+        for path, _, size in sorted(self._disk_entries(), key=lambda e: e[1]):
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._disk_bytes -= size
+            self.stats["evictions"] += 1
+
+
+cache_service = CacheService()
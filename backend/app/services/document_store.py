@@ -0,0 +1,225 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+from ..config import settings
+from ..models.schemas import KnowledgeMap
+from ..services.shared_state import shared_state
+
+
+class Document:
+    """Chunks and generated maps for one uploaded PDF"""
+
+    def __init__(self, filename: str, content_hash: str, chunks: List[str]):
+        self.document_id = uuid.uuid4().hex
+        self.filename = filename
+        self.content_hash = content_hash
+        self.chunks = chunks
+        # Chunks whose maps the upload generates; the rest are generated on
+        # demand, a page at a time
+        self.selected: List[int] = list(range(len(chunks)))
+        # Aligned with chunks; None until a valid map has been generated
+        self.maps: List[Optional[KnowledgeMap]] = [None] * len(chunks)
+        self._map_bytes = 0
+        # Fingerprints of this version, for re-processing a later one incrementally
+        self.page_hashes: List[str] = []
+        self.anchors: List[str] = []
+        self.reused_maps = 0
+        self.created_at = time.time()
+        self.last_access = self.created_at
+
+    def size_bytes(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks) + self._map_bytes
+
+    def set_map(self, index: int, knowledge_map: Optional[KnowledgeMap]) -> None:
+        previous = self.maps[index]
+        if previous is not None:
+            self._map_bytes -= len(previous.model_dump_json())
+        if knowledge_map is not None:
+            self._map_bytes += len(knowledge_map.model_dump_json())
+        self.maps[index] = knowledge_map
+
+    def to_dict(self) -> dict:
+        return {
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "content_hash": self.content_hash,
+            "chunks": self.chunks,
+            "selected": self.selected,
+            "page_hashes": self.page_hashes,
+            "anchors": self.anchors,
+            "reused_maps": self.reused_maps,
+            "created_at": self.created_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, maps: Optional[list] = None) -> "Document":
+        document = cls(data["filename"], data["content_hash"], data["chunks"])
+        document.document_id = data["document_id"]
+        document.selected = data["selected"]
+        document.page_hashes = data["page_hashes"]
+        document.anchors = data["anchors"]
+        document.reused_maps = data["reused_maps"]
+        document.created_at = data["created_at"]
+        for index, knowledge_map in enumerate(maps or []):
+            if knowledge_map is not None:
+                document.set_map(index, KnowledgeMap.model_validate(knowledge_map))
+        return document
+
+    def selected_chunks(self) -> List[str]:
+        return [self.chunks[i] for i in self.selected]
+
+    def find_chunk(self, subtopic_title: str) -> Optional[int]:
+        """Index of the chunk whose map contains the given subtopic"""
+        for index, knowledge_map in enumerate(self.maps):
+            if knowledge_map is None:
+                continue
+            for sub in knowledge_map.subtopics:
+                if sub.title == subtopic_title:
+                    return index
+        return None
+
+
+def _maps_namespace(document_id: str) -> str:
+    """Shared state namespace holding a document's maps, keyed by chunk index"""
+    return f"document_maps:{document_id}"
+
+
+class DocumentStore:
+    """Per-document session state with TTL, LRU and memory-cap eviction
+
+    With several workers, documents and their maps are also written to the
+    shared state, so any worker can serve a document another one extracted;
+    the caps and LRU eviction apply to each worker's own copies.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = None,
+        max_entries: int = None,
+        max_bytes: int = None,
+    ):
+        self.ttl_seconds = ttl_seconds or settings.DOCUMENT_TTL_SECONDS
+        self.max_entries = max_entries or settings.DOCUMENT_MAX_ENTRIES
+        self.max_bytes = max_bytes or settings.DOCUMENT_MAX_BYTES
+        self._documents: "OrderedDict[str, Document]" = OrderedDict()
+        self._bytes = 0
+
+    def create(self, filename: str, content_hash: str, chunks: List[str]) -> Document:
+        document = Document(filename, content_hash, chunks)
+        if shared_state.enabled:
+            shared_state.put(
+                "document", document.document_id, document.to_dict(), self.ttl_seconds
+            )
+        self._add(document)
+        return document
+
+    def update(self, document: Document) -> None:
+        """Share fields changed since create with the other workers"""
+        if shared_state.enabled:
+            shared_state.put(
+                "document", document.document_id, document.to_dict(), self.ttl_seconds
+            )
+
+    async def get(self, document_id: str) -> Optional[Document]:
+        self._expire()
+        document = self._documents.get(document_id)
+        if shared_state.enabled:
+            if document is None:
+                document = await self._load_shared(document_id)
+            elif None in document.maps:
+                # Maps may still be arriving from the worker running the upload
+                await self._refresh_maps(document)
+        if document is not None:
+            document.last_access = time.time()
+            self._documents.move_to_end(document_id)
+            if shared_state.enabled:
+                shared_state.touch("document", document_id, self.ttl_seconds)
+                shared_state.touch_all(_maps_namespace(document_id), self.ttl_seconds)
+        return document
+
+    def set_map(
+        self, document_id: str, index: int, knowledge_map: Optional[KnowledgeMap]
+    ) -> None:
+        document = self._documents.get(document_id)
+        if document is None:
+            return
+        previous = document.size_bytes()
+        document.set_map(index, knowledge_map)
+        self._bytes += document.size_bytes() - previous
+        if shared_state.enabled:
+            # One row per map, so each write stays small however long the document
+            if knowledge_map is None:
+                shared_state.delete(_maps_namespace(document_id), str(index))
+            else:
+                shared_state.put(
+                    _maps_namespace(document_id),
+                    str(index),
+                    knowledge_map.model_dump(),
+                    self.ttl_seconds,
+                )
+        self._evict()
+
+    def delete(self, document_id: str) -> None:
+        document = self._documents.pop(document_id, None)
+        if document is not None:
+            self._bytes -= document.size_bytes()
+
+    def get_stats(self) -> dict:
+        return {"documents": len(self._documents), "bytes": self._bytes}
+
+    def _add(self, document: Document) -> None:
+        self._documents[document.document_id] = document
+        self._bytes += document.size_bytes()
+        self._evict()
+
+    async def _refresh_maps(self, document: Document) -> None:
+        maps = await shared_state.items(_maps_namespace(document.document_id))
+        if self._documents.get(document.document_id) is not document:
+            # Evicted meanwhile
+            return
+        previous = document.size_bytes()
+        for index, knowledge_map in maps.items():
+            if document.maps[int(index)] is None:
+                document.set_map(int(index), KnowledgeMap.model_validate(knowledge_map))
+        self._bytes += document.size_bytes() - previous
+
+    async def _load_shared(self, document_id: str) -> Optional[Document]:
+        """Copy a document created by another worker into this one"""
+        data = await shared_state.get("document", document_id)
+        if data is None:
+            return None
+        shared_maps = await shared_state.items(_maps_namespace(document_id))
+        if document_id in self._documents:
+            # Loaded by a concurrent request meanwhile
+            return self._documents[document_id]
+        maps: List[Optional[dict]] = [None] * len(data["chunks"])
+        for index, knowledge_map in shared_maps.items():
+            maps[int(index)] = knowledge_map
+        document = Document.from_dict(data, maps)
+        self._add(document)
+        return document
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            document_id
+            for document_id, document in self._documents.items()
+            if document.last_access < cutoff
+        ]
+        for document_id in expired:
+            self.delete(document_id)
+
+    def _evict(self) -> None:
+        """Drop least recently used documents until under the entry and memory caps"""
+        self._expire()
+        while len(self._documents) > 1 and (
+            len(self._documents) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            document_id = next(iter(self._documents))
+            print(f"Evicting document {document_id} from the document store")
+            self.delete(document_id)
+
+
+document_store = DocumentStore()
@@ -0,0 +1,279 @@
+import asyncio
+import itertools
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ..config import settings
+from ..models.schemas import ChunkProgress, JobStatus, KnowledgeMap, UploadResponse
+from ..services.document_store import Document, document_store
+from ..services.knowledge_service import knowledge_service
+from ..services.question_bank import question_bank
+from ..services.shared_state import shared_state
+from ..services.version_store import version_store
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at JOB_MAX_QUEUE_DEPTH"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, document: Document, priority: int = 0, summarize: bool = False):
+        self.job_id = uuid.uuid4().hex
+        self.document_id = document.document_id
+        self.chunks = document.selected_chunks()
+        # Document chunk index of each of the job's chunks
+        self.selected = list(document.selected)
+        self.chunks_total = len(document.chunks)
+        self.priority = priority
+        # One map-reduce knowledge map for the document instead of one per chunk
+        self.summarize = summarize
+        # Maps reused from a previous version of the document, aligned with chunks
+        self.existing_maps = [document.maps[i] for i in document.selected]
+        self.status = "queued"
+        self.chunk_status = ["pending"] * len(self.chunks)
+        self.result: Optional[UploadResponse] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def to_status(self, queue_position: Optional[int] = None) -> JobStatus:
+        return JobStatus(
+            job_id=self.job_id,
+            status=self.status,
+            priority=self.priority,
+            queue_position=queue_position,
+            chunks_total=len(self.chunks),
+            chunks_completed=sum(s != "pending" for s in self.chunk_status),
+            chunks=[
+                ChunkProgress(chunk=i, chunk_index=self.selected[i], status=s)
+                for i, s in enumerate(self.chunk_status)
+            ],
+            result=self.result,
+            error=self.error,
+            created_at=self.created_at.isoformat(),
+            started_at=self.started_at.isoformat() if self.started_at else None,
+            finished_at=self.finished_at.isoformat() if self.finished_at else None,
+        )
+
+
+class JobQueue:
+    """In-process priority queue of upload jobs served by a fixed worker pool
+
+    With several uvicorn workers a job runs in the worker it was submitted
+    to, which publishes its status to the shared state so any worker can
+    report it; cancelling through another worker leaves a request there
+    that the owning worker picks up.
+    """
+
+    def __init__(self, workers: int = None, max_depth: int = None):
+        self.num_workers = workers or settings.JOB_WORKERS
+        self.max_depth = max_depth or settings.JOB_MAX_QUEUE_DEPTH
+        self.jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._syncer: Optional[asyncio.Task] = None
+        # Tie-breaker so equal priorities run first-in, first-out
+        self._sequence = itertools.count()
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+        if shared_state.enabled:
+            self._syncer = asyncio.create_task(self._sync_loop())
+
+    async def stop(self) -> None:
+        tasks = self._workers + ([self._syncer] if self._syncer else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._syncer = None
+        self._queue = None
+
+    def submit(
+        self, document: Document, priority: int = 0, summarize: bool = False
+    ) -> Job:
+        """Queue a job; higher priority runs first, FIFO within a priority"""
+        self.start()
+        self._prune()
+
+        self.raise_if_full()
+
+        job = Job(document, priority, summarize)
+        self.jobs[job.job_id] = job
+        self._queue.put_nowait((-priority, next(self._sequence), job))
+        self._publish(job)
+        return job
+
+    def raise_if_full(self) -> None:
+        """Raise QueueFullError while JOB_MAX_QUEUE_DEPTH jobs are queued"""
+        if self.queued_count() >= self.max_depth:
+            raise QueueFullError(settings.JOB_RETRY_AFTER_SECONDS)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def status(self, job_id: str) -> Optional[JobStatus]:
+        """Status of a job of this worker, or as last published by another one"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_status(self.queue_position(job))
+        if shared_state.enabled:
+            data = await shared_state.get("job", job_id)
+            if data is not None:
+                return JobStatus.model_validate(data)
+        return None
+
+    async def cancel(self, job_id: str) -> Optional[JobStatus]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            status = await self.status(job_id)
+            if status is not None and status.status in ("queued", "running"):
+                shared_state.put(
+                    "job_cancel", job_id, True, settings.JOB_RESULT_TTL_SECONDS
+                )
+            return status
+        if job.done:
+            return job.to_status()
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            # Still queued; the worker skips it when dequeued
+            job.status = "cancelled"
+            job.finished_at = datetime.utcnow()
+            self._publish(job)
+        return job.to_status(self.queue_position(job))
+
+    def queued_count(self) -> int:
+        return sum(job.status == "queued" for job in self.jobs.values())
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        if job.status != "queued":
+            return None
+        ahead = [
+            other
+            for other in self.jobs.values()
+            if other.status == "queued"
+            and (-other.priority, other.created_at) < (-job.priority, job.created_at)
+        ]
+        return len(ahead)
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than JOB_RESULT_TTL_SECONDS"""
+        cutoff = time.time() - settings.JOB_RESULT_TTL_SECONDS
+        expired = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.done and job.finished_at.timestamp() < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            if job.status != "queued":
+                continue
+
+            job.status = "running"
+            job.started_at = datetime.utcnow()
+            self._publish(job)
+            print(f"Worker {worker_id} running job {job.job_id}")
+            job.task = asyncio.create_task(self._run(job))
+            try:
+                await job.task
+                job.status = "completed"
+            except asyncio.CancelledError:
+                if not job.task.cancelled():
+                    # The worker itself is shutting down
+                    job.task.cancel()
+                    raise
+                job.status = "cancelled"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = datetime.utcnow()
+                job.task = None
+                self._publish(job)
+
+    def _publish(self, job: Job) -> None:
+        if shared_state.enabled:
+            shared_state.put(
+                "job",
+                job.job_id,
+                job.to_status(self.queue_position(job)).model_dump(),
+                settings.JOB_RESULT_TTL_SECONDS,
+            )
+
+    async def _sync_loop(self) -> None:
+        """Publish the progress of unfinished jobs and apply remote cancellations"""
+        while True:
+            await asyncio.sleep(settings.JOB_SYNC_INTERVAL_SECONDS)
+            for job in [j for j in self.jobs.values() if not j.done]:
+                if await shared_state.get("job_cancel", job.job_id):
+                    shared_state.delete("job_cancel", job.job_id)
+                    await self.cancel(job.job_id)
+                self._publish(job)
+
+    async def _run(self, job: Job) -> None:
+        if job.summarize:
+
+            def on_summary(index: int, succeeded: bool) -> None:
+                job.chunk_status[index] = "completed" if succeeded else "failed"
+
+            knowledge_map = await knowledge_service.generate_document_map(
+                job.chunks, on_summary
+            )
+            document = await document_store.get(job.document_id)
+            if document is not None:
+                version_store.save(document)
+                question_bank.fill_document(document, [knowledge_map])
+            job.result = UploadResponse(
+                maps=[knowledge_map],
+                message=f"Summarized {len(job.chunks)} chunks into one knowledge map",
+                chunks_processed=len(job.chunks),
+                document_id=job.document_id,
+                chunks_total=job.chunks_total,
+            )
+            return
+
+        def on_chunk(index: int, knowledge_map: Optional[KnowledgeMap]) -> None:
+            job.chunk_status[index] = "completed" if knowledge_map else "failed"
+            document_store.set_map(job.document_id, job.selected[index], knowledge_map)
+
+        results = await knowledge_service.generate_knowledge_maps(
+            job.chunks, on_chunk, job.existing_maps
+        )
+        document = await document_store.get(job.document_id)
+        if document is not None:
+            version_store.save(document)
+            question_bank.fill_document(document)
+        knowledge_maps = [m for m in results if m is not None]
+        job.result = UploadResponse(
+            maps=knowledge_maps,
+            message=f"Successfully processed {len(knowledge_maps)} knowledge maps",
+            chunks_processed=len(job.chunks),
+            document_id=job.document_id,
+            chunks_reused=sum(m is not None for m in job.existing_maps),
+            chunks_total=job.chunks_total,
+        )
+
+
+job_queue = JobQueue()
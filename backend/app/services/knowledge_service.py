@@ -1,16 +1,125 @@
-from typing import List
+import asyncio
+import re
+from contextlib import aclosing
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+from pydantic import TypeAdapter
 
 from ..config import settings
+from ..models.schemas import (
+    DocumentSummary,
+    KnowledgeMap,
+    QuizQuestion,
+    Subtopic,
+    SubtopicQuestionRequest,
+)
+from ..services.cache_service import cache_service
+from ..services.metrics_service import LLM_RETRIES, STAGE_SECONDS, VALIDATION_FAILURES
 from ..services.ollama_service import ollama_service
+from ..services.selection_service import best_matches
+from ..utils.json_stream import IncrementalJSONParser
+from ..utils.resilience import backoff_delay
+from ..utils.tokenizer import get_token_counter, truncate_to_tokens
+from ..utils.validators import (
+    ResponseValidationError,
+    parse_document_summary,
+    parse_knowledge_map,
+    parse_question_batch,
+    parse_questions,
+)
+
+# Bump whenever a prompt template changes so cached results are invalidated
+PROMPT_VERSION = "1"
+
+T = TypeVar("T")
+
+KNOWLEDGE_MAP_SCHEMA = KnowledgeMap.model_json_schema()
+QUESTIONS_SCHEMA = TypeAdapter(List[QuizQuestion]).json_schema()
+SUMMARY_SCHEMA = DocumentSummary.model_json_schema()
+
+SUMMARY_FORMAT = """{
+  "topic": "Main topic title",
+  "sections": [
+    {
+      "title": "Section title",
+      "summary": "One or two sentences on what this section teaches.",
+      "key_concepts": ["concept 1", "concept 2", "concept 3"]
+    }
+  ]
+}"""
+
+# Rough size of one generated question, used to budget batched prompts
+QUESTION_TOKEN_ESTIMATE = 150
+
+
+def _question_batch_schema(keys: List[str]) -> dict:
+    return {
+        "type": "object",
+        "properties": {key: QUESTIONS_SCHEMA for key in keys},
+        "required": keys,
+    }
+
+
+def _normalize_question(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def dedupe_questions(
+    questions: List[QuizQuestion], existing: List[str]
+) -> List[QuizQuestion]:
+    """Drop questions that repeat an existing question or each other"""
+    seen = {_normalize_question(q) for q in existing}
+    unique = []
+    for q in questions:
+        key = _normalize_question(q.question)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(q)
+    return unique
+
+
+def _format_summary(summary: DocumentSummary) -> str:
+    """Compact plain-text outline of a summary, used as merge prompt input"""
+    lines = [f"Topic: {summary.topic}"]
+    lines.extend(
+        f"- {s.title}: {s.summary} (key concepts: {', '.join(s.key_concepts)})"
+        for s in summary.sections
+    )
+    return "\n".join(lines)
+
+
+def _concatenate_summaries(summaries: List[DocumentSummary]) -> DocumentSummary:
+    """Fallback merge keeping evenly spaced sections when the model merge fails"""
+    sections = [section for summary in summaries for section in summary.sections]
+    limit = settings.SUMMARY_MAX_SUBTOPICS
+    if len(sections) > limit:
+        step = len(sections) / limit
+        sections = [sections[int(i * step)] for i in range(limit)]
+    return DocumentSummary(topic=summaries[0].topic, sections=sections)
+
+
+def _response_format(schema: dict) -> Union[str, dict, None]:
+    """Ollama `format` value for the configured structured-output mode"""
+    if settings.OLLAMA_FORMAT == "schema":
+        return schema
+    if settings.OLLAMA_FORMAT == "json":
+        return "json"
+    return None
 
 
 class KnowledgeService:
     def __init__(self):
         self.ollama = ollama_service
+        self.cache = cache_service
+
+    def _knowledge_map_key(self, text_chunk: str) -> str:
+        return self.cache.key(
+            "knowledge_map", self.ollama.model, PROMPT_VERSION, text_chunk
+        )
 
-    def generate_knowledge_map(self, text_chunk: str) -> str:
-        """Generate a knowledge map from a text chunk"""
-        prompt = f"""
+    @staticmethod
+    def _knowledge_map_prompt(text_chunk: str) -> str:
+        return f"""
 You are an educational AI assistant. Given the following educational content, return ONLY a valid JSON object structured exactly as below. Do not include any commentary or extra text — only valid JSON.
 
 ### JSON Format:
@@ -46,20 +155,158 @@ Generate a knowledge map based on the content below. Every quiz question **must*
 ### Educational Content:
 {text_chunk}
 """
-        return self.ollama.generate_response(prompt)
 
-    def generate_additional_questions(
+    def chunk_token_budget(self) -> int:
+        """Largest chunk that fits the context window alongside the prompt and response"""
+        if settings.MAX_TOKENS_PER_CHUNK:
+            return settings.MAX_TOKENS_PER_CHUNK
+        overhead = get_token_counter().count(self._knowledge_map_prompt(""))
+        return max(1, settings.OLLAMA_NUM_CTX - settings.OLLAMA_NUM_PREDICT - overhead)
+
+    async def _generate_json(
+        self,
+        prompt: str,
+        expected_start: str,
+        schema: dict,
+        parse: Callable[[str], T],
+        label: str,
+        num_predict: Optional[int] = None,
+    ) -> Tuple[T, str]:
+        """Stream a JSON answer, aborting and retrying as soon as it goes wrong
+
+        Tokens are checked by an incremental parser: a structural error stops
+        the generation immediately and the next attempt starts, and the stream
+        is closed as soon as the top-level value is complete. Ollama errors
+        are retried with exponential backoff. Returns the parsed value and its
+        JSON text, or raises ResponseValidationError describing the last
+        failed attempt (CircuitOpenError if Ollama is known to be down).
+        num_predict caps the response length below OLLAMA_NUM_PREDICT.
+        """
+        error = ResponseValidationError(f"No {label} generated")
+        reason = None
+        for attempt in range(settings.MAX_RETRIES):
+            if reason is not None:
+                LLM_RETRIES.inc(reason=reason)
+            print(
+                f"Generating {label} (attempt {attempt + 1}/{settings.MAX_RETRIES})..."
+            )
+            parser = IncrementalJSONParser(expected_start)
+            tokens = []
+            stream = self.ollama.stream_response(
+                prompt, _response_format(schema), num_predict
+            )
+            async with aclosing(stream):
+                async for token in stream:
+                    tokens.append(token)
+                    if not parser.feed(token) or parser.complete:
+                        break
+
+            if parser.complete:
+                try:
+                    with STAGE_SECONDS.time(stage="validation"):
+                        return parse(parser.text), parser.text
+                except ResponseValidationError as e:
+                    print(f"Generated {label} failed validation")
+                    error = e
+                    reason = "invalid"
+                    VALIDATION_FAILURES.inc(kind="schema")
+                continue
+
+            result = "".join(tokens)
+            if result.startswith("Error:"):
+                print(f"Ollama error: {result}")
+                error = ResponseValidationError(result)
+                reason = "ollama_error"
+                if attempt + 1 < settings.MAX_RETRIES:
+                    await asyncio.sleep(backoff_delay(attempt))
+            elif parser.error:
+                print(f"Aborted malformed {label}: {parser.error}")
+                error = ResponseValidationError(
+                    f"Malformed {label}", [{"loc": [], "msg": parser.error}]
+                )
+                reason = "malformed"
+                VALIDATION_FAILURES.inc(kind="malformed")
+            else:
+                print(f"Incomplete {label} from model")
+                error = ResponseValidationError(f"Incomplete {label}")
+                reason = "incomplete"
+                VALIDATION_FAILURES.inc(kind="incomplete")
+        raise error
+
+    async def generate_knowledge_map(self, text_chunk: str) -> KnowledgeMap:
+        """Generate a knowledge map from a text chunk
+
+        Raises ResponseValidationError if no valid map could be generated.
+        """
+        cache_key = self._knowledge_map_key(text_chunk)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return parse_knowledge_map(cached)
+
+        prompt = self._knowledge_map_prompt(text_chunk)
+        knowledge_map, map_json = await self._generate_json(
+            prompt, "{", KNOWLEDGE_MAP_SCHEMA, parse_knowledge_map, "knowledge map"
+        )
+        self.cache.set(cache_key, map_json)
+        return knowledge_map
+
+    async def generate_knowledge_maps(
+        self,
+        chunks: List[str],
+        on_chunk: Optional[Callable[[int, Optional[KnowledgeMap]], None]] = None,
+        existing: Optional[List[Optional[KnowledgeMap]]] = None,
+    ) -> List[Optional[KnowledgeMap]]:
+        """Generate validated knowledge maps for all chunks concurrently
+
+        Results keep chunk order; a chunk whose map fails validation yields
+        None. on_chunk is called with (index, map_or_None) as each chunk finishes.
+        Chunks that already have a map in existing are not regenerated.
+        """
+        semaphore = asyncio.Semaphore(settings.UPLOAD_CHUNK_CONCURRENCY)
+
+        async def generate(index: int, chunk: str) -> Optional[KnowledgeMap]:
+            if existing is not None and existing[index] is not None:
+                if on_chunk is not None:
+                    on_chunk(index, existing[index])
+                return existing[index]
+            async with semaphore:
+                print(f"Processing chunk {index + 1}/{len(chunks)}")
+                try:
+                    knowledge_map = await self.generate_knowledge_map(chunk)
+                except ResponseValidationError:
+                    print(f"Skipping invalid map for chunk {index + 1}")
+                    knowledge_map = None
+
+            if on_chunk is not None:
+                on_chunk(index, knowledge_map)
+            return knowledge_map
+
+        return await asyncio.gather(
+            *(generate(i, chunk) for i, chunk in enumerate(chunks))
+        )
+
+    async def generate_additional_questions(
         self,
         subtopic_title: str,
         subtopic_description: str,
         key_concepts: List[str],
         num_questions: int = 3,
-    ) -> str:
-        """Generate additional quiz questions for a subtopic"""
+        source_text: Optional[str] = None,
+    ) -> List[QuizQuestion]:
+        """Generate additional quiz questions for a subtopic
+
+        When source_text is given, questions are grounded in that passage.
+        Raises ResponseValidationError if no valid questions could be generated.
+        """
+        source = (
+            f"\nBase every question on this source material:\n{source_text}\n"
+            if source_text
+            else ""
+        )
         prompt = f"""Generate {num_questions} multiple choice quiz questions for: {subtopic_title}
 
 Key concepts: {', '.join(key_concepts[:3])}
-
+{source}
 IMPORTANT: Every question MUST include an explanation field. Do not omit it.
 
 Return ONLY valid JSON array like this:
@@ -80,26 +327,384 @@ Return ONLY valid JSON array like this:
 
 Make questions challenging but fair. ALWAYS include explanations for each question."""
 
-        # Try up to max retries
-        for attempt in range(settings.MAX_RETRIES):
-            try:
-                print(
-                    f"Generating questions (attempt {attempt + 1}/{settings.MAX_RETRIES})..."
+        # Not cached: the prompt is the same on every request for more
+        # questions, and each one should get new questions
+        questions, questions_json = await self._generate_json(
+            prompt, "[", QUESTIONS_SCHEMA, parse_questions, "questions"
+        )
+        print(f"AI Response: {questions_json[:200]}...")
+        return questions
+
+    @staticmethod
+    def _question_batch_prompt(
+        entries: List[Tuple[str, SubtopicQuestionRequest]],
+        sources: List[str],
+        num_questions: int,
+    ) -> str:
+        source = "".join(
+            f"\nSource material {i + 1}:\n{text}\n" for i, text in enumerate(sources)
+        )
+        if source:
+            source = "\nBase every question on the source material below." + source
+        subtopics = "\n".join(
+            f"- {key}: {sub.title} (key concepts: {', '.join(sub.key_concepts[:3])})"
+            + (
+                f"\n  Do not repeat: {'; '.join(sub.existing_questions)}"
+                if sub.existing_questions
+                else ""
+            )
+            for key, sub in entries
+        )
+        example_key = entries[0][0]
+        return f"""Generate {num_questions} multiple choice quiz questions for EACH of these subtopics:
+{subtopics}
+{source}
+IMPORTANT: Every question MUST include an explanation field. Do not omit it.
+
+Return ONLY a valid JSON object with one key per subtopic id, each holding an array of questions like this:
+{{
+  "{example_key}": [
+    {{
+      "question": "What is the main purpose of X?",
+      "options": ["A. Option A", "B. Option B", "C. Option C", "D. Option D"],
+      "answer": "B. Option B",
+      "explanation": "B is correct because it explains the main purpose clearly."
+    }}
+  ]
+}}
+
+Make questions challenging but fair. ALWAYS include explanations for each question."""
+
+    def _pack_question_batches(
+        self,
+        subtopics: List[SubtopicQuestionRequest],
+        sources: List[Optional[str]],
+        num_questions: int,
+    ) -> Tuple[List[List[int]], List[Optional[str]]]:
+        """Group subtopic indices into prompts that fit the context window
+
+        Subtopics sharing a source chunk are kept together so the source is
+        only sent once per prompt. Sources too long to fit a prompt with any
+        of their subtopics are truncated, or dropped when nothing fits, so
+        returns the batches and the sources to prompt with.
+        """
+        counter = get_token_counter()
+        input_budget = settings.OLLAMA_NUM_CTX - settings.OLLAMA_NUM_PREDICT
+        overhead = counter.count(
+            self._question_batch_prompt(
+                [("subtopic_1", subtopics[0])], [], num_questions
+            )
+        )
+        output_per_subtopic = num_questions * QUESTION_TOKEN_ESTIMATE + 10
+        costs = [
+            counter.count(
+                f"{sub.title} {' '.join(sub.key_concepts[:3])} "
+                f"{' '.join(sub.existing_questions)}"
+            )
+            + 20
+            for sub in subtopics
+        ]
+
+        # Room left for each source next to the largest subtopic using it
+        source_room: Dict[str, int] = {}
+        for source, cost in zip(sources, costs):
+            if source:
+                room = input_budget - overhead - cost - 10
+                source_room[source] = min(source_room.get(source, room), room)
+        fitted = {
+            source: truncate_to_tokens(source, room, counter) or None
+            for source, room in source_room.items()
+        }
+        sources = [fitted[source] if source else None for source in sources]
+        source_tokens = {}
+
+        order = sorted(range(len(subtopics)), key=lambda i: (sources[i] or "", i))
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        batch_sources: set = set()
+        input_tokens = overhead
+        output_tokens = 0
+        for i in order:
+            cost = costs[i]
+            source = sources[i]
+            if source and source not in source_tokens:
+                source_tokens[source] = counter.count(source) + 10
+            source_cost = source_tokens[source] if source else 0
+
+            new_source = source and source not in batch_sources
+            if batch and (
+                input_tokens + cost + (source_cost if new_source else 0) > input_budget
+                or output_tokens + output_per_subtopic > settings.OLLAMA_NUM_PREDICT
+            ):
+                batches.append(batch)
+                batch, batch_sources = [], set()
+                input_tokens, output_tokens = overhead, 0
+                new_source = bool(source)
+
+            batch.append(i)
+            if new_source:
+                batch_sources.add(source)
+                input_tokens += source_cost
+            input_tokens += cost
+            output_tokens += output_per_subtopic
+        if batch:
+            batches.append(batch)
+        return batches, sources
+
+    async def _generate_question_batch(
+        self,
+        indices: List[int],
+        subtopics: List[SubtopicQuestionRequest],
+        sources: List[Optional[str]],
+        num_questions: int,
+    ) -> Dict[int, List[QuizQuestion]]:
+        keys = [f"subtopic_{n + 1}" for n in range(len(indices))]
+        entries = [(key, subtopics[i]) for key, i in zip(keys, indices)]
+        prompt_sources = list(dict.fromkeys(sources[i] for i in indices if sources[i]))
+        prompt = self._question_batch_prompt(entries, prompt_sources, num_questions)
+
+        cache_key = self.cache.key(
+            "question_batch", self.ollama.model, PROMPT_VERSION, prompt
+        )
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            batch = parse_question_batch(cached, keys)
+        else:
+            batch, batch_json = await self._generate_json(
+                prompt,
+                "{",
+                _question_batch_schema(keys),
+                lambda text: parse_question_batch(text, keys),
+                f"questions for {len(keys)} subtopics",
+            )
+            self.cache.set(cache_key, batch_json)
+        return {i: batch[key] for key, i in zip(keys, indices)}
+
+    async def generate_question_batch(
+        self,
+        subtopics: List[SubtopicQuestionRequest],
+        num_questions: int = 3,
+        sources: Optional[List[Optional[str]]] = None,
+    ) -> Tuple[List[Optional[List[QuizQuestion]]], int]:
+        """Generate questions for many subtopics in as few prompts as fit
+
+        Prompts run concurrently and results are split back out per subtopic,
+        with questions duplicating a subtopic's existing ones removed. Returns
+        the per-subtopic results (None where generation failed) and the
+        number of prompts used.
+        """
+        if not subtopics:
+            return [], 0
+        if sources is None:
+            sources = [None] * len(subtopics)
+
+        batches, sources = self._pack_question_batches(
+            subtopics, sources, num_questions
+        )
+        results: List[Optional[List[QuizQuestion]]] = [None] * len(subtopics)
+        outcomes = await asyncio.gather(
+            *(
+                self._generate_question_batch(batch, subtopics, sources, num_questions)
+                for batch in batches
+            ),
+            return_exceptions=True,
+        )
+        for batch, outcome in zip(batches, outcomes):
+            if isinstance(outcome, ResponseValidationError):
+                print(f"Question batch failed: {outcome}")
+                continue
+            if isinstance(outcome, BaseException):
+                raise outcome
+            for i, questions in outcome.items():
+                results[i] = dedupe_questions(
+                    questions, subtopics[i].existing_questions
+                )
+        return results, len(batches)
+
+    @staticmethod
+    def _chunk_summary_prompt(text_chunk: str) -> str:
+        return f"""Summarize the educational content below as a compact outline. Return ONLY valid JSON structured exactly like this:
+{SUMMARY_FORMAT}
+
+Use at most {settings.SUMMARY_MAX_SUBTOPICS} sections, keep each summary under 40 words and list at most 5 key concepts per section.
+
+### Educational Content:
+{text_chunk}
+"""
+
+    @staticmethod
+    def _merge_summaries_prompt(parts: List[str]) -> str:
+        outlines = "\n\n".join(
+            f"### Part {i + 1}:\n{part}" for i, part in enumerate(parts)
+        )
+        return f"""Below are outlines of consecutive parts of one document. Merge them into a single outline of the whole document: combine sections that cover the same idea, group related sections under broader titles and keep the order of the document. Return ONLY valid JSON structured exactly like this:
+{SUMMARY_FORMAT}
+
+Use at most {settings.SUMMARY_MAX_SUBTOPICS} sections, keep each summary under 40 words and list at most 5 key concepts per section.
+
+{outlines}
+"""
+
+    async def _summarize(
+        self, namespace: str, prompt: str, label: str
+    ) -> DocumentSummary:
+        cache_key = self.cache.key(namespace, self.ollama.model, PROMPT_VERSION, prompt)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return parse_document_summary(cached)
+
+        summary, summary_json = await self._generate_json(
+            prompt,
+            "{",
+            SUMMARY_SCHEMA,
+            parse_document_summary,
+            label,
+            num_predict=settings.SUMMARY_MAX_TOKENS,
+        )
+        self.cache.set(cache_key, summary_json)
+        return summary
+
+    def _pack_summaries(self, parts: List[str]) -> Tuple[List[List[int]], List[str]]:
+        """Group consecutive summaries into merge prompts that fit the context window
+
+        Groups hold at least two summaries so every level shrinks; a trailing
+        single summary is carried to the next level unmerged. Summaries are
+        truncated to half the budget so any two fit, so returns the groups
+        and the summaries to prompt with.
+        """
+        counter = get_token_counter()
+        budget = (
+            settings.OLLAMA_NUM_CTX
+            - settings.SUMMARY_MAX_TOKENS
+            - counter.count(self._merge_summaries_prompt([]))
+        )
+        parts = [truncate_to_tokens(part, budget // 2 - 10, counter) for part in parts]
+        groups: List[List[int]] = []
+        group: List[int] = []
+        tokens = 0
+        for i, part in enumerate(parts):
+            cost = counter.count(part) + 10
+            if len(group) >= 2 and tokens + cost > budget:
+                groups.append(group)
+                group, tokens = [], 0
+            group.append(i)
+            tokens += cost
+        if group:
+            groups.append(group)
+        return groups, parts
+
+    async def _merge_level(
+        self, summaries: List[DocumentSummary], semaphore: asyncio.Semaphore
+    ) -> List[DocumentSummary]:
+        groups, parts = self._pack_summaries(
+            [_format_summary(summary) for summary in summaries]
+        )
+
+        async def merge(group: List[int]) -> DocumentSummary:
+            if len(group) == 1:
+                return summaries[group[0]]
+            async with semaphore:
+                try:
+                    return await self._summarize(
+                        "summary_merge",
+                        self._merge_summaries_prompt([parts[i] for i in group]),
+                        f"merged summary of {len(group)} parts",
+                    )
+                except ResponseValidationError:
+                    print(f"Concatenating {len(group)} summaries after a failed merge")
+                    return _concatenate_summaries([summaries[i] for i in group])
+
+        return await asyncio.gather(*(merge(group) for group in groups))
+
+    async def generate_document_map(
+        self,
+        chunks: List[str],
+        on_chunk: Optional[Callable[[int, bool], None]] = None,
+        num_questions: int = 3,
+    ) -> KnowledgeMap:
+        """Build one knowledge map for a whole document by hierarchical map-reduce
+
+        Chunks are summarized concurrently with short, length-capped prompts,
+        then the summaries are merged level by level, in groups that fit the
+        context window, into a single topic tree. Quizzes are generated last
+        for the final subtopics, each grounded in its most similar chunk.
+        Every level at least halves the number of summaries, so total token
+        cost grows linearly with the document. on_chunk is called with
+        (index, succeeded) as each chunk summary finishes. Raises
+        ResponseValidationError if no chunk could be summarized.
+        """
+        semaphore = asyncio.Semaphore(settings.UPLOAD_CHUNK_CONCURRENCY)
+        counter = get_token_counter()
+        chunk_budget = (
+            settings.OLLAMA_NUM_CTX
+            - settings.SUMMARY_MAX_TOKENS
+            - counter.count(self._chunk_summary_prompt(""))
+        )
+
+        async def summarize(index: int, chunk: str) -> Optional[DocumentSummary]:
+            async with semaphore:
+                print(f"Summarizing chunk {index + 1}/{len(chunks)}")
+                try:
+                    summary = await self._summarize(
+                        "chunk_summary",
+                        self._chunk_summary_prompt(
+                            truncate_to_tokens(chunk, chunk_budget, counter)
+                        ),
+                        "chunk summary",
+                    )
+                except ResponseValidationError:
+                    print(f"Skipping invalid summary for chunk {index + 1}")
+                    summary = None
+
+            if on_chunk is not None:
+                on_chunk(index, summary is not None)
+            return summary
+
+        results = await asyncio.gather(
+            *(summarize(i, chunk) for i, chunk in enumerate(chunks))
+        )
+        summaries = [summary for summary in results if summary is not None]
+        if not summaries:
+            raise ResponseValidationError(
+                "No chunk of the document could be summarized"
+            )
+
+        level = 0
+        while len(summaries) > 1:
+            level += 1
+            print(f"Merging {len(summaries)} summaries (level {level})")
+            summaries = await self._merge_level(summaries, semaphore)
+        outline = summaries[0]
+        sections = outline.sections[: settings.SUMMARY_MAX_SUBTOPICS]
+
+        matches = await asyncio.to_thread(
+            best_matches,
+            chunks,
+            [f"{s.title} {s.summary} {' '.join(s.key_concepts)}" for s in sections],
+        )
+        quizzes, _ = await self.generate_question_batch(
+            [
+                SubtopicQuestionRequest(
+                    title=s.title, description=s.summary, key_concepts=s.key_concepts
+                )
+                for s in sections
+            ],
+            num_questions,
+            [chunks[i] for i in matches],
+        )
+        return KnowledgeMap(
+            topic=outline.topic,
+            subtopics=[
+                Subtopic(
+                    title=s.title,
+                    description=s.summary,
+                    key_concepts=s.key_concepts,
+                    status="unmastered",
+                    quiz=quiz or [],
                 )
-                result = self.ollama.generate_response(prompt)
-                if result and not result.startswith("Error:"):
-                    print(f"AI Response: {result[:200]}...")
-                    return result
-                else:
-                    print(f"Ollama error: {result}")
-                    if attempt == settings.MAX_RETRIES - 1:
-                        return result or "Error: No response from model"
-            except Exception as e:
-                print(f"Unexpected error on attempt {attempt + 1}: {e}")
-                if attempt == settings.MAX_RETRIES - 1:
-                    return f"Error: {str(e)}"
-
-        return "Error: All attempts failed"
+                for s, quiz in zip(sections, quizzes)
+            ],
+        )
 
 
 knowledge_service = KnowledgeService()
@@ -0,0 +1,73 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from ..models.schemas import KnowledgeMap
+from ..services.backend_pool import background_priority
+from ..services.document_store import Document, document_store
+from ..services.knowledge_service import knowledge_service
+from ..services.question_bank import question_bank
+from ..services.version_store import version_store
+from ..utils.resilience import CircuitOpenError
+
+
+class MapPager:
+    """Generates a document's chunk maps a page at a time, as learners reach them
+
+    Maps are kept on the document and in the result cache, so each chunk is
+    generated once. The next page can be prefetched at background priority
+    while the current one is being read.
+    """
+
+    def __init__(self):
+        self._prefetches: Dict[Tuple[str, int], asyncio.Task] = {}
+
+    async def page(
+        self, document: Document, start: int, limit: int
+    ) -> List[Optional[KnowledgeMap]]:
+        """Maps of chunks start to start + limit, generating the missing ones
+
+        Generations a prefetch of the same page already started are joined
+        rather than repeated, and run at this request's priority from then on.
+        """
+        stop = min(start + limit, len(document.chunks))
+        missing = [i for i in range(start, stop) if document.maps[i] is None]
+        if missing:
+
+            def on_chunk(position: int, knowledge_map: Optional[KnowledgeMap]) -> None:
+                document_store.set_map(
+                    document.document_id, missing[position], knowledge_map
+                )
+
+            await knowledge_service.generate_knowledge_maps(
+                [document.chunks[i] for i in missing], on_chunk
+            )
+            version_store.save(document)
+            question_bank.fill_document(document)
+        return document.maps[start:stop]
+
+    def prefetch(self, document: Document, start: int, limit: int) -> None:
+        """Generate the page at start in the background, unless already underway"""
+        key = (document.document_id, start)
+        if start >= len(document.chunks) or key in self._prefetches:
+            return
+        with background_priority():
+            task = asyncio.create_task(self._prefetch(document, start, limit))
+        self._prefetches[key] = task
+        task.add_done_callback(lambda _: self._prefetches.pop(key, None))
+
+    async def stop(self) -> None:
+        tasks = list(self._prefetches.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _prefetch(self, document: Document, start: int, limit: int) -> None:
+        try:
+            await self.page(document, start, limit)
+        except CircuitOpenError:
+            pass
+        except Exception as e:
+            print(f"Prefetching maps from chunk {start + 1} failed: {e}")
+
+
+map_pager = MapPager()
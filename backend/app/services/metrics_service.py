@@ -0,0 +1,305 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; covers fast CPU stages up to slow LLM generations
+DURATION_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500, 1000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def total(self, **labels: str) -> float:
+        """Sum over every label combination matching the given label values"""
+        wanted = [(self.labels.index(name), str(v)) for name, v in labels.items()]
+        with self._lock:
+            return sum(
+                value
+                for key, value in self._values.items()
+                if all(key[i] == v for i, v in wanted)
+            )
+
+    def empty(self) -> "Counter":
+        return Counter(self.name, self.documentation, self.labels)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def load(self, snapshot: list) -> None:
+        """Add the values of another process's snapshot"""
+        with self._lock:
+            for key, value in snapshot:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0.0) + value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram:
+    """Cumulative bucketed distribution of observed values"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts incl. +Inf, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall time of the with-block, even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def empty(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, self.labels, self.buckets)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(k), list(c), s] for k, (c, s) in self._values.items()]
+
+    def load(self, snapshot: list) -> None:
+        """Add the values of another process's snapshot"""
+        with self._lock:
+            for key, counts, total in snapshot:
+                key = tuple(key)
+                mine, my_total = self._values.get(key, ([0] * len(counts), 0.0))
+                merged = [a + b for a, b in zip(mine, counts)]
+                self._values[key] = (merged, my_total + total)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(
+        self, name: str, documentation: str, labels: Sequence[str] = ()
+    ) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, list]:
+        """Values of every metric, in a JSON-serializable form load() accepts"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self, snapshots: Optional[List[Dict[str, list]]] = None) -> str:
+        """Prometheus text of this process, or of the sum of the given snapshots"""
+        metrics = self._metrics
+        if snapshots is not None:
+            metrics = [metric.empty() for metric in self._metrics]
+            for metric in metrics:
+                for snapshot in snapshots:
+                    metric.load(snapshot.get(metric.name, []))
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram(
+    "readly_http_request_duration_seconds",
+    "Time to produce an HTTP response, by route",
+    labels=("method", "route", "status"),
+)
+STAGE_SECONDS = registry.histogram(
+    "readly_stage_duration_seconds",
+    "Time spent in each processing stage",
+    labels=("stage",),
+)
+LLM_CALL_SECONDS = registry.histogram(
+    "readly_llm_call_duration_seconds",
+    "Wall time of each Ollama generation call",
+    labels=("backend", "outcome"),
+)
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "readly_llm_eval_tokens_per_second",
+    "Generation speed: reported by Ollama (eval_count / eval_duration) with "
+    'source="ollama", or estimated from streamed tokens with source="estimated"',
+    labels=("backend", "source"),
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+LLM_PROMPT_EVAL_SECONDS = registry.histogram(
+    "readly_llm_prompt_eval_duration_seconds",
+    "Prompt processing time: reported by Ollama (prompt_eval_duration) with "
+    'source="ollama", or time to the first streamed token, including queueing '
+    'and model load, with source="estimated"',
+    labels=("backend", "source"),
+)
+LLM_TOKENS = registry.counter(
+    "readly_llm_tokens_total",
+    "Tokens processed by Ollama, by kind (prompt or eval) and source (ollama "
+    "for reported counts, estimated for streamed tokens counted by the client)",
+    labels=("backend", "kind", "source"),
+)
+LLM_RETRIES = registry.counter(
+    "readly_llm_retries_total",
+    "Generation attempts retried, by the reason the previous attempt failed",
+    labels=("reason",),
+)
+LLM_COALESCED = registry.counter(
+    "readly_llm_coalesced_total",
+    "Generations that joined an identical one already in flight instead of calling Ollama",
+    labels=("kind",),
+)
+VALIDATION_FAILURES = registry.counter(
+    "readly_validation_failures_total",
+    "Model outputs rejected by structural or schema validation",
+    labels=("kind",),
+)
+CACHE_LOOKUPS = registry.counter(
+    "readly_cache_lookups_total",
+    "Result cache lookups by namespace and outcome (memory_hit, disk_hit, miss)",
+    labels=("namespace", "result"),
+)
+
+
+def record_llm_stats(
+    backend: str,
+    eval_count: int,
+    eval_seconds: float,
+    prompt_eval_count: int = 0,
+    prompt_eval_seconds: float = None,
+    source: str = "ollama",
+) -> None:
+    """Record token counts and timings of one generation
+
+    source is "ollama" for figures Ollama reported, or "estimated" for ones
+    measured by the client, which are kept apart.
+    """
+    if eval_count:
+        LLM_TOKENS.inc(eval_count, backend=backend, kind="eval", source=source)
+    if prompt_eval_count:
+        LLM_TOKENS.inc(prompt_eval_count, backend=backend, kind="prompt", source=source)
+    if eval_count and eval_seconds > 0:
+        LLM_TOKENS_PER_SECOND.observe(
+            eval_count / eval_seconds, backend=backend, source=source
+        )
+    if prompt_eval_seconds is not None:
+        LLM_PROMPT_EVAL_SECONDS.observe(
+            prompt_eval_seconds, backend=backend, source=source
+        )
+
+
+def record_ollama_stats(backend: str, data: dict) -> None:
+    """Record the counters from a final Ollama response object (durations in ns)"""
+    prompt_eval_duration = data.get("prompt_eval_duration")
+    record_llm_stats(
+        backend,
+        data.get("eval_count") or 0,
+        (data.get("eval_duration") or 0) / 1e9,
+        data.get("prompt_eval_count") or 0,
+        prompt_eval_duration / 1e9 if prompt_eval_duration is not None else None,
+    )
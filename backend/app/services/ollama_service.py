@@ -1,99 +1,406 @@
+import asyncio
 import time
-from typing import Optional
+from datetime import datetime
+from typing import AsyncIterator, Callable, List, Optional, Union
 
-import requests
+import httpx
 
 from ..config import settings
+from ..utils import json_backend
+from ..utils.resilience import backoff_delay
+from ..utils.single_flight import SingleFlight
+from ..services.backend_pool import BackendPool, OllamaBackend, SharedPriority
+from ..services.cache_service import content_hash
+from ..services.metrics_service import (
+    LLM_CALL_SECONDS,
+    LLM_COALESCED,
+    record_llm_stats,
+    record_ollama_stats,
+)
+
+# Texts sent per /api/embed request
+EMBED_BATCH_SIZE = 32
+
+
+def keep_warm_active(now: datetime) -> bool:
+    """Whether now falls within KEEP_WARM_HOURS (start-end, may wrap midnight)"""
+    if settings.keep_warm_hours is None:
+        return True
+    start, end = settings.keep_warm_hours
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
 
 
 class OllamaService:
-    def __init__(self):
-        self.base_url = settings.OLLAMA_BASE_URL
+    def __init__(self, pool: Optional[BackendPool] = None):
         self.model = settings.OLLAMA_MODEL
-        self.timeout = settings.OLLAMA_TIMEOUT
+        # Generations are spread across these hosts, each with its own
+        # in-flight cap and circuit breaker
+        self.pool = pool or BackendPool.from_settings()
+        self._prober: Optional[asyncio.Task] = None
+        self._warmer: Optional[asyncio.Task] = None
+        # True until the startup status check and preload have finished
+        self.warming = False
+        # Identical concurrent generations share one Ollama call
+        self.flights = SingleFlight()
+
+    @property
+    def status(self) -> dict:
+        """Last prober result, aggregated over the backends serving the model"""
+        backends = self.pool.serving(self.model)
+        checked = [b.status["checked_at"] for b in backends if b.status["checked_at"]]
+        return {
+            "ollama_available": any(b.status["ollama_available"] for b in backends),
+            "model_available": any(b.status["model_available"] for b in backends),
+            "checked_at": max(checked) if checked else None,
+        }
+
+    def circuit_state(self) -> str:
+        return self.pool.circuit_state(self.model)
+
+    def raise_if_unavailable(self) -> None:
+        """Raise CircuitOpenError while every backend for the model is ejected"""
+        self.pool.raise_if_unavailable(self.model)
+
+    async def get_backend_stats(self) -> List[dict]:
+        return await self.pool.get_stats()
 
-    def check_status(self) -> bool:
+    @staticmethod
+    def options() -> dict:
+        """Generation options sent with every prompt"""
+        return {
+            "num_ctx": settings.OLLAMA_NUM_CTX,
+            "num_predict": settings.OLLAMA_NUM_PREDICT,
+        }
+
+    def _payload(
+        self,
+        prompt: str,
+        stream: bool,
+        format: Union[str, dict, None],
+        num_predict: Optional[int] = None,
+    ) -> dict:
+        options = self.options()
+        if num_predict is not None:
+            options["num_predict"] = num_predict
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": options,
+            "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+        }
+        if format is not None:
+            # "json" or a JSON schema that constrains decoding
+            payload["format"] = format
+        return payload
+
+    async def close(self) -> None:
+        """Release pooled connections"""
+        await self.pool.close()
+
+    async def check_status(self) -> bool:
         """Check if Ollama is running and accessible"""
+        await self.probe(verbose=True)
+        return self.status["model_available"]
+
+    async def probe(self, verbose: bool = False) -> dict:
+        """Refresh the cached Ollama and model status of every backend"""
+        await asyncio.gather(
+            *(self._probe_backend(b, verbose) for b in self.pool.backends)
+        )
+        return self.status
+
+    async def _probe_backend(self, backend: OllamaBackend, verbose: bool) -> None:
+        """Refresh one backend's status
+
+        Messages are printed only when the status changes unless verbose is
+        set. An unreachable backend is ejected straight away, and an ejected
+        one that answers again is let back in for a trial call.
+        """
+        previous = (
+            backend.status["ollama_available"],
+            backend.status["model_available"],
+        )
+        ollama_available = model_available = False
+        message = None
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = await backend.client.get("/api/tags", timeout=5)
             if response.status_code == 200:
+                ollama_available = True
                 models = response.json().get("models", [])
-                mistral_available = any(
+                model_available = any(
                     self.model in model.get("name", "").lower() for model in models
                 )
-                if mistral_available:
-                    print(f"Ollama is running and {self.model} model is available")
-                    return True
+                if model_available:
+                    message = f"Ollama is running and {self.model} model is available"
                 else:
-                    print(f"Ollama is running but {self.model} model not found")
-                    print(f"Install with: ollama pull {self.model}")
-                    return False
+                    message = (
+                        f"Ollama is running but {self.model} model not found\n"
+                        f"Install with: ollama pull {self.model}"
+                    )
             else:
-                print(f"Ollama responded with status: {response.status_code}")
-                return False
-        except requests.exceptions.ConnectionError:
-            print("Cannot connect to Ollama - is it running?")
-            print("Start Ollama with: ollama serve")
-            return False
+                message = f"Ollama responded with status: {response.status_code}"
+        except httpx.ConnectError:
+            message = (
+                "Cannot connect to Ollama - is it running?\n"
+                "Start Ollama with: ollama serve"
+            )
         except Exception as e:
-            print(f"Error checking Ollama: {e}")
-            return False
+            message = f"Error checking Ollama: {e}"
+
+        if not ollama_available:
+            backend.breaker.trip()
+        elif model_available:
+            # Reachable again: the next generation decides whether to close
+            backend.breaker.half_open()
+        backend.status = {
+            "ollama_available": ollama_available,
+            "model_available": model_available,
+            "checked_at": datetime.utcnow(),
+        }
+        if verbose or previous != (ollama_available, model_available):
+            print(f"[{backend.url}] {message}")
+
+    def start_prober(self) -> None:
+        """Probe Ollama every HEALTH_PROBE_INTERVAL_SECONDS in the background"""
+        if self._prober is None or self._prober.done():
+            self._prober = asyncio.create_task(self._probe_loop())
+
+    async def stop_prober(self) -> None:
+        if self._prober is not None:
+            self._prober.cancel()
+            await asyncio.gather(self._prober, return_exceptions=True)
+            self._prober = None
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.HEALTH_PROBE_INTERVAL_SECONDS)
+            await self.probe()
+
+    def start_warmup(self) -> None:
+        """Check status and preload in the background, then keep the model warm
+
+        The server accepts requests meanwhile; health reports "warming" until
+        the preload has finished.
+        """
+        if self._warmer is None or self._warmer.done():
+            self.warming = True
+            self._warmer = asyncio.create_task(self._warm_loop())
+
+    async def stop_warmup(self) -> None:
+        if self._warmer is not None:
+            self._warmer.cancel()
+            await asyncio.gather(self._warmer, return_exceptions=True)
+            self._warmer = None
+
+    async def _warm_loop(self) -> None:
+        try:
+            print("Checking Ollama status...")
+            if not await self.check_status():
+                print("Warning: Ollama is not accessible")
+                print("Make sure Ollama is running: ollama serve")
+                print(f"And the model is installed: ollama pull {self.model}")
 
-    def preload_model(self) -> bool:
-        """Preload the model to avoid cold start delays"""
+            print("Preloading model...")
+            if await self.preload_model():
+                print("Model warm - server ready!")
+            else:
+                print("Failed to preload model - please check Ollama")
+        finally:
+            self.warming = False
+
+        if settings.KEEP_WARM_INTERVAL_SECONDS <= 0:
+            return
+        while True:
+            await asyncio.sleep(settings.KEEP_WARM_INTERVAL_SECONDS)
+            if keep_warm_active(datetime.now()):
+                await self.keep_warm()
+
+    async def keep_warm(self) -> None:
+        """Ask each reachable backend to keep the model loaded for OLLAMA_KEEP_ALIVE"""
+        backends = [b for b in self.pool.serving(self.model) if b.breaker.available()]
+        results = await asyncio.gather(
+            *(self._load_model(b) for b in backends), return_exceptions=True
+        )
+        for backend, result in zip(backends, results):
+            if result is not True:
+                print(f"Keep-warm ping to {backend.url} failed: {result}")
+
+    async def _load_model(self, backend: OllamaBackend) -> bool:
+        """Load the model without generating anything, refreshing its keep_alive"""
+        response = await backend.client.post(
+            "/api/generate",
+            json={"model": self.model, "keep_alive": settings.OLLAMA_KEEP_ALIVE},
+        )
+        if response.status_code != 200:
+            print(f"Model load failed on {backend.url}: {response.status_code}")
+        return response.status_code == 200
+
+    async def preload_model(self) -> bool:
+        """Preload the model on every backend to avoid cold start delays"""
+        results = await asyncio.gather(
+            *(self._preload_backend(b) for b in self.pool.serving(self.model))
+        )
+        return any(results)
+
+    async def _preload_backend(self, backend: OllamaBackend) -> bool:
         max_attempts = settings.MAX_RETRIES
         for attempt in range(max_attempts):
             try:
                 print(
-                    f"Preloading {self.model} model (attempt {attempt + 1}/{max_attempts})..."
-                )
-                response = requests.post(
-                    f"{self.base_url}/api/generate",
-                    json={"model": self.model, "prompt": "Hello", "stream": False},
-                    timeout=self.timeout,
+                    f"Preloading {self.model} model on {backend.url} "
+                    f"(attempt {attempt + 1}/{max_attempts})..."
                 )
-                if response.status_code == 200:
-                    print("Model preloaded successfully")
+                if await self._load_model(backend):
+                    print(f"Model preloaded successfully on {backend.url}")
                     return True
-                else:
-                    print(f"Model preload failed: {response.status_code}")
-            except requests.exceptions.Timeout:
+            except httpx.TimeoutException:
                 print(f"Attempt {attempt + 1} timed out - retrying...")
-            except requests.exceptions.ConnectionError:
-                print("Cannot connect to Ollama - make sure it's running")
+                await asyncio.sleep(backoff_delay(attempt))
+            except httpx.ConnectError:
+                print(
+                    f"Cannot connect to Ollama at {backend.url} - make sure it's running"
+                )
                 print("Start Ollama with: ollama serve")
                 return False
             except Exception as e:
                 print(f"Attempt {attempt + 1} failed: {e}")
 
-        print("Failed to preload model after all attempts")
+        print(f"Failed to preload model on {backend.url} after all attempts")
         return False
 
-    def generate_response(self, prompt: str) -> Optional[str]:
-        """Generate a response using the Ollama model"""
+    def _flight_key(self, payload: dict) -> Optional[str]:
+        """Fingerprint identical generations share, or None when coalescing is off"""
+        if not settings.LLM_COALESCE_ENABLED:
+            return None
+        return content_hash(payload)
+
+    @staticmethod
+    def _on_join(kind: str, priority: SharedPriority) -> Callable[[], None]:
+        def on_join() -> None:
+            LLM_COALESCED.inc(kind=kind)
+            priority.join()
+
+        return on_join
+
+    def stream_response(
+        self,
+        prompt: str,
+        format: Union[str, dict, None] = None,
+        num_predict: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """Stream response tokens from the Ollama model as they are generated
+
+        Concurrent streams with the same model, prompt and options share one
+        generation; a late subscriber first replays the tokens so far. Closing
+        the iterator early unsubscribes, and closes the connection, stopping
+        the generation on the Ollama side, once no subscriber is left. Raises
+        CircuitOpenError without calling Ollama while every backend is known
+        to be down. num_predict overrides OLLAMA_NUM_PREDICT for this
+        generation.
+        """
+        payload = self._payload(prompt, True, format, num_predict)
+        key = self._flight_key(payload)
+        if key is None:
+            return self._stream(payload)
+        priority = SharedPriority()
+        return self.flights.stream(
+            key,
+            lambda: self._stream(payload, priority),
+            self._on_join("stream", priority),
+        )
+
+    async def _stream(
+        self, payload: dict, priority: Optional[SharedPriority] = None
+    ) -> AsyncIterator[str]:
+        async with self.pool.acquire(self.model, priority) as backend:
+            start_time = time.perf_counter()
+            status_code = None
+            failed = False
+            # Streamed lines carry one token each; used for throughput when
+            # the caller closes the stream before Ollama's final stats line
+            first_token_at = last_token_at = None
+            token_lines = 0
+            try:
+                async with backend.client.stream(
+                    "POST", "/api/generate", json=payload
+                ) as response:
+                    status_code = response.status_code
+                    if response.status_code != 200:
+                        body = (await response.aread()).decode(errors="replace")
+                        yield f"Error: {response.status_code} - {body}"
+                        return
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        data = json_backend.loads(line)
+                        if data.get("response"):
+                            last_token_at = time.perf_counter()
+                            if first_token_at is None:
+                                first_token_at = last_token_at
+                            token_lines += 1
+                            yield data["response"]
+                        if data.get("done"):
+                            record_ollama_stats(backend.url, data)
+                            token_lines = 0
+                            return
+            except Exception as e:
+                failed = True
+                yield f"Error: {str(e)}"
+            finally:
+                # A stream closed early by the caller still counts as a success
+                elapsed = time.perf_counter() - start_time
+                if failed or status_code is not None:
+                    ok = not failed and status_code == 200
+                    backend.record(None if failed else status_code, elapsed)
+                    LLM_CALL_SECONDS.observe(
+                        elapsed, backend=backend.url, outcome="ok" if ok else "error"
+                    )
+                if token_lines:
+                    record_llm_stats(
+                        backend.url,
+                        token_lines,
+                        last_token_at - first_token_at,
+                        prompt_eval_seconds=first_token_at - start_time,
+                        source="estimated",
+                    )
+
+    async def embed(self, texts: List[str], model: str) -> Optional[List[List[float]]]:
+        """Embedding vector per text from Ollama's /api/embed, or None on failure"""
+        if not self.pool.serving(model):
+            return None
+        embeddings = []
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json={"model": self.model, "prompt": prompt, "stream": False},
-                timeout=self.timeout,
-            )
-            if response.status_code == 200:
-                return response.json()["response"]
-            else:
-                return f"Error: {response.status_code} - {response.text}"
+            for start in range(0, len(texts), EMBED_BATCH_SIZE):
+                async with self.pool.acquire(model) as backend:
+                    response = await backend.client.post(
+                        "/api/embed",
+                        json={
+                            "model": model,
+                            "input": texts[start : start + EMBED_BATCH_SIZE],
+                        },
+                    )
+                if response.status_code != 200:
+                    print(f"Embedding failed: {response.status_code} - {response.text}")
+                    return None
+                embeddings.extend(response.json()["embeddings"])
         except Exception as e:
-            return f"Error: {str(e)}"
+            print(f"Embedding failed: {e}")
+            return None
+        return embeddings
 
-    def test_connection(self) -> dict:
+    async def test_connection(self) -> dict:
         """Test endpoint to check Ollama performance"""
         start_time = time.time()
 
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json={"model": self.model, "prompt": "Say hello", "stream": False},
-                timeout=self.timeout,
-            )
+            async with self.pool.acquire(self.model) as backend:
+                response = await backend.client.post(
+                    "/api/generate",
+                    json={"model": self.model, "prompt": "Say hello", "stream": False},
+                )
 
             elapsed = time.time() - start_time
 
@@ -121,9 +428,5 @@ class OllamaService:
 ollama_service = OllamaService()
 
 
-def check_ollama_status() -> bool:
-    return ollama_service.check_status()
-
-
-def preload_model() -> bool:
-    return ollama_service.preload_model()
+async def preload_model() -> bool:
+    return await ollama_service.preload_model()
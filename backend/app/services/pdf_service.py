@@ -1,43 +1,472 @@
+import asyncio
+import bisect
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
 import fitz
 from fastapi import UploadFile
 
 from ..config import settings
+from ..services.cache_service import cache_service
+from ..services.metrics_service import STAGE_SECONDS
+from ..utils.tokenizer import TokenCounter, get_token_counter, truncate_to_tokens
+
+# Size of each read when spooling an upload to disk
+SPOOL_READ_BYTES = 1024 * 1024
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+# Upper bound on the characters of one token, limiting the text measured to
+# split an oversized sentence
+MAX_CHARS_PER_TOKEN = 32
+# How far ahead in the previous version's chunk starts a match may force a break
+ANCHOR_WINDOW = 64
+# Preceding units hashed into an anchor, so repeated words or headings differ
+ANCHOR_CONTEXT = 3
+
+
+def chunk_anchor(context: Sequence[str], unit: str) -> str:
+    """Fingerprint of the point in the text where a chunk's own content starts"""
+    return hashlib.sha1("\0".join([*context, unit]).encode()).hexdigest()[:16]
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.PDF_EXTRACT_WORKERS)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Stop the extraction worker processes"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Worker entry point: open the document independently and extract a page range"""
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def _pages_key(content_hash: str, start: Optional[int] = None) -> str:
+    """Cache key of the page range starting at start, or of the range bounds"""
+    return cache_service.key(
+        "pages", content_hash, "ranges" if start is None else start
+    )
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES"""
+
+
+class SpooledPDF:
+    """A PDF upload copied to a temporary file, deleted on close"""
+
+    def __init__(self, path: str, content_hash: str, size: int):
+        self.path = path
+        self.content_hash = content_hash
+        self.size = size
+
+    def close(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SpooledPDF":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
 
 
 class PDFService:
+    @staticmethod
+    async def spool_upload(file: UploadFile, max_bytes: int = None) -> SpooledPDF:
+        """Copy an upload to disk in bounded reads, hashing and size-checking as it goes"""
+        if max_bytes is None:
+            max_bytes = settings.MAX_UPLOAD_BYTES
+
+        if file.size is not None and file.size > max_bytes:
+            raise UploadTooLargeError(
+                f"File is {file.size} bytes, limit is {max_bytes} bytes"
+            )
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while data := await file.read(SPOOL_READ_BYTES):
+                    size += len(data)
+                    if size > max_bytes:
+                        raise UploadTooLargeError(
+                            f"File exceeds the {max_bytes} byte upload limit"
+                        )
+                    digest.update(data)
+                    out.write(data)
+        except BaseException:
+            os.remove(path)
+            raise
+
+        return SpooledPDF(path, digest.hexdigest(), size)
+
+    @staticmethod
+    def page_count(path: str) -> int:
+        with fitz.open(path) as doc:
+            return doc.page_count
+
+    @staticmethod
+    def iter_pages(path: str) -> Iterator[str]:
+        """Yield the text of each page, reading the PDF from disk"""
+        with fitz.open(path) as doc:
+            for page in doc:
+                yield page.get_text()
+
+    @staticmethod
+    def cached_pages(content_hash: str) -> Optional[List[str]]:
+        """Text of every page from an earlier extraction, if all of it is cached"""
+        bounds = cache_service.get(_pages_key(content_hash))
+        if bounds is None:
+            return None
+        pages = []
+        for start, _ in bounds:
+            page_range = cache_service.get(_pages_key(content_hash, start))
+            if page_range is None:
+                return None
+            pages.extend(page_range)
+        return pages
+
+    @staticmethod
+    def cache_pages(content_hash: str, pages: List[str]) -> None:
+        """Cache the text of every page as a single range"""
+        cache_service.set(_pages_key(content_hash, 0), pages)
+        cache_service.set(_pages_key(content_hash), [[0, len(pages)]])
+
+    @staticmethod
+    async def iter_page_ranges(spooled: SpooledPDF) -> AsyncIterator[List[str]]:
+        """Yield the text of every page as consecutive page ranges, in order
+
+        Large documents are extracted in parallel on the process pool; each
+        range is yielded as soon as it and the ranges before it are done,
+        while later ones are still being extracted. Ranges are cached one by
+        one, so a repeat upload of the same file skips extraction.
+        """
+        content_hash = spooled.content_hash
+        bounds = cache_service.get(_pages_key(content_hash))
+        if bounds is not None:
+            for start, stop in bounds:
+                page_range = cache_service.get(_pages_key(content_hash, start))
+                if page_range is None:
+                    page_range = await asyncio.to_thread(
+                        _extract_page_range, spooled.path, start, stop
+                    )
+                    cache_service.set(_pages_key(content_hash, start), page_range)
+                yield page_range
+            return
+
+        with STAGE_SECONDS.time(stage="pdf_extract"):
+            count = await asyncio.to_thread(PDFService.page_count, spooled.path)
+            workers = settings.PDF_EXTRACT_WORKERS
+            if count < settings.PDF_PARALLEL_PAGE_THRESHOLD or workers < 2:
+                step = max(count, 1)
+                extract = asyncio.to_thread
+            else:
+                step = -(-count // workers)
+                loop = asyncio.get_running_loop()
+
+                def extract(*args):
+                    return loop.run_in_executor(_get_executor(), *args)
+
+            bounds = [
+                [start, min(start + step, count)] for start in range(0, count, step)
+            ]
+            futures = [
+                asyncio.ensure_future(
+                    extract(_extract_page_range, spooled.path, start, stop)
+                )
+                for start, stop in bounds
+            ]
+            try:
+                for (start, _), future in zip(bounds, futures):
+                    page_range = await future
+                    cache_service.set(_pages_key(content_hash, start), page_range)
+                    yield page_range
+            finally:
+                for future in futures:
+                    future.cancel()
+        cache_service.set(_pages_key(content_hash), bounds)
+
+    @staticmethod
+    def iter_pages_blocking(
+        ranges: AsyncIterator[List[str]], loop: asyncio.AbstractEventLoop
+    ) -> Iterator[str]:
+        """Pages of ranges running on loop, for a consumer in another thread"""
+        try:
+            while True:
+                try:
+                    page_range = asyncio.run_coroutine_threadsafe(
+                        ranges.__anext__(), loop
+                    ).result()
+                except StopAsyncIteration:
+                    return
+                yield from page_range
+        finally:
+            asyncio.run_coroutine_threadsafe(ranges.aclose(), loop).result()
+
+    @staticmethod
+    async def extract_pages(spooled: SpooledPDF) -> List[str]:
+        """Extract page text off the event loop, in parallel for large documents"""
+        return [
+            text
+            async for page_range in PDFService.iter_page_ranges(spooled)
+            for text in page_range
+        ]
+
+    @staticmethod
+    async def extract_pages_from_pdf(file: UploadFile) -> List[str]:
+        """Extract the text of each page of an uploaded PDF file"""
+        with await PDFService.spool_upload(file) as spooled:
+            return await PDFService.extract_pages(spooled)
+
     @staticmethod
     async def extract_text_from_pdf(file: UploadFile) -> str:
         """Extract text from uploaded PDF file"""
-        content = await file.read()
-        doc = fitz.open(stream=content, filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
+        return "".join(await PDFService.extract_pages_from_pdf(file))
 
     @staticmethod
-    def chunk_text(text: str, max_tokens: int = None) -> list:
-        """Split text into manageable chunks"""
+    def _iter_paragraphs(pages: Iterable[str]) -> Iterator[str]:
+        """Yield blank-line separated paragraphs from a stream of page texts"""
+        # Trailing paragraph that may continue on the next page
+        carry: List[str] = []
+        for text in pages:
+            carry.append(text)
+            if "\n\n" not in text and not text.startswith("\n"):
+                continue
+            paragraphs = "".join(carry).split("\n\n")
+            carry = [paragraphs.pop()]
+            yield from paragraphs
+        yield "".join(carry)
+
+    @staticmethod
+    def _iter_units(
+        pages: Iterable[str], max_tokens: int, counter: TokenCounter
+    ) -> Iterator[Tuple[str, str, int]]:
+        """Yield (separator, text, tokens) units no larger than max_tokens
+
+        Paragraphs are used whole when they fit, otherwise they fall back to
+        sentences, then to the longest runs of words that measure at most
+        max_tokens, splitting a word only when it alone is too long.
+        """
+        for para in PDFService._iter_paragraphs(pages):
+            para = para.strip()
+            if not para:
+                continue
+            tokens = counter.count(para)
+            if tokens <= max_tokens:
+                yield "\n\n", para, tokens
+                continue
+
+            sep = "\n\n"
+            for sentence in SENTENCE_BOUNDARY.split(para):
+                tokens = counter.count(sentence)
+                if tokens <= max_tokens:
+                    yield sep, sentence, tokens
+                    sep = " "
+                    continue
+                rest = sentence.strip()
+                while rest:
+                    window = rest[: max_tokens * MAX_CHARS_PER_TOKEN]
+                    piece = truncate_to_tokens(window, max_tokens, counter)
+                    if len(piece) < len(rest):
+                        # Back off to the last word boundary, if the piece has one
+                        boundary = max(piece.rfind(" "), piece.rfind("\n"))
+                        if boundary > 0:
+                            piece = piece[:boundary].rstrip()
+                    # A single character may exceed a tiny budget; keep going
+                    piece = piece or rest[0]
+                    yield sep, piece, counter.count(piece)
+                    rest = rest[len(piece) :]
+                    sep = " " if rest[:1].isspace() else ""
+                    rest = rest.lstrip()
+                sep = " "
+
+    @staticmethod
+    def chunk_pages(
+        pages: Iterable[str],
+        max_tokens: int = None,
+        overlap_tokens: int = None,
+        counter: TokenCounter = None,
+    ) -> Iterator[str]:
+        """Split a stream of page texts into chunks of at most max_tokens tokens
+
+        Runs in linear time, consuming pages lazily. With overlap_tokens, each
+        chunk starts with trailing units of the previous one. max_tokens
+        defaults to MAX_TOKENS_PER_CHUNK, or else to OLLAMA_NUM_CTX less
+        OLLAMA_NUM_PREDICT, which leaves no room for a prompt; callers that
+        send chunks in a prompt pass knowledge_service.chunk_token_budget().
+        """
+        for chunk, _ in PDFService._iter_chunks(
+            pages, max_tokens, overlap_tokens, counter, None, fingerprint=False
+        ):
+            yield chunk
+
+    @staticmethod
+    def iter_chunks(
+        pages: Iterable[str],
+        max_tokens: int = None,
+        overlap_tokens: int = None,
+        counter: TokenCounter = None,
+        anchors: Optional[Sequence[str]] = None,
+    ) -> Iterator[Tuple[str, str]]:
+        """chunk_pages, yielding (chunk, anchor) pairs
+
+        A chunk's anchor fingerprints the unit its own (non-overlap) content
+        starts with, together with the units before it. Passing the anchors of
+        a previous version of the document, in order, ends a chunk early where
+        one of the next few old chunk starts recurs, so chunk boundaries line
+        up with the old ones again right after an edited region.
+        """
+        return PDFService._iter_chunks(
+            pages, max_tokens, overlap_tokens, counter, anchors, fingerprint=True
+        )
+
+    @staticmethod
+    def _iter_chunks(
+        pages: Iterable[str],
+        max_tokens: Optional[int],
+        overlap_tokens: Optional[int],
+        counter: Optional[TokenCounter],
+        anchors: Optional[Sequence[str]],
+        fingerprint: bool,
+    ) -> Iterator[Tuple[str, str]]:
+        """Chunker behind chunk_pages and iter_chunks; anchors are "" unless fingerprint"""
         if max_tokens is None:
-            max_tokens = settings.MAX_TOKENS_PER_CHUNK
+            max_tokens = settings.MAX_TOKENS_PER_CHUNK or (
+                settings.OLLAMA_NUM_CTX - settings.OLLAMA_NUM_PREDICT
+            )
+        if overlap_tokens is None:
+            overlap_tokens = settings.CHUNK_OVERLAP_TOKENS
+        overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        if counter is None:
+            counter = get_token_counter()
 
-        paragraphs = text.split("\n\n")
-        chunks = []
-        current = ""
+        def join(units) -> str:
+            return "".join(
+                (sep if i else "") + text for i, (sep, text, _) in enumerate(units)
+            )
 
-        for para in paragraphs:
-            if len(current) + len(para) < max_tokens * 4:
-                current += para + "\n\n"
-            else:
-                if current.strip():
-                    chunks.append(current.strip())
-                current = para + "\n\n"
+        units = PDFService._iter_units(pages, max_tokens, counter)
+        # Stack of units to re-read before pulling new ones
+        pending: List[Tuple[str, str, int]] = []
+        current: List[Tuple[str, str, int]] = []
+        current_tokens = 0
+        # Leading units of current that were copied from the previous chunk
+        overlap_count = 0
+        # Texts of the last units before current's own content, in document order
+        tail: List[str] = []
+        anchor = ""
 
-        if current.strip():
-            chunks.append(current.strip())
+        def context() -> List[str]:
+            own = current[max(overlap_count, len(current) - ANCHOR_CONTEXT) :]
+            return (tail + [u[1] for u in own])[-ANCHOR_CONTEXT:]
 
-        return chunks
+        # Old anchor -> its chunk positions, and the next old chunk expected
+        anchor_positions: Dict[str, List[int]] = {}
+        for position, key in enumerate(anchors or ()):
+            anchor_positions.setdefault(key, []).append(position)
+        expected = 0
+
+        def old_position(key: str, window: int = None) -> Optional[int]:
+            positions = anchor_positions.get(key)
+            if not positions:
+                return None
+            i = bisect.bisect_left(positions, expected)
+            if i == len(positions) or (
+                window is not None and positions[i] >= expected + window
+            ):
+                return None
+            return positions[i]
+
+        while True:
+            unit = pending.pop() if pending else next(units, None)
+            at_anchor = (
+                anchor_positions
+                and unit is not None
+                and len(current) > overlap_count
+                and old_position(chunk_anchor(context(), unit[1]), ANCHOR_WINDOW)
+                is not None
+            )
+            # Separators are counted as one token each
+            if (
+                unit is not None
+                and not at_anchor
+                and (not current or current_tokens + 1 + unit[2] <= max_tokens)
+            ):
+                if fingerprint and len(current) == overlap_count:
+                    anchor = chunk_anchor(context(), unit[1])
+                    position = old_position(anchor)
+                    if position is not None:
+                        expected = position + 1
+                current_tokens += unit[2] + (1 if current else 0)
+                current.append(unit)
+                continue
+
+            if unit is not None:
+                pending.append(unit)
+            if len(current) == overlap_count:
+                if unit is None:
+                    break
+                # Only overlap so far; trim it until the next unit fits
+                while current and current_tokens + 1 + unit[2] > max_tokens:
+                    current_tokens -= current.pop(0)[2] + 1
+                overlap_count = len(current)
+                continue
+
+            chunk = join(current)
+            # Summed unit counts are an estimate, so verify the exact count
+            while len(current) > 1 and counter.count(chunk) > max_tokens:
+                pending.append(current.pop())
+                chunk = join(current)
+            if fingerprint:
+                tail = (tail + [u[1] for u in current[overlap_count:]])[
+                    -ANCHOR_CONTEXT:
+                ]
+            yield chunk, anchor
+
+            kept: List[Tuple[str, str, int]] = []
+            kept_tokens = 0
+            for prev in reversed(current):
+                if kept_tokens + prev[2] + 1 > overlap_tokens:
+                    break
+                kept.insert(0, prev)
+                kept_tokens += prev[2] + 1
+            current, current_tokens, overlap_count = kept, kept_tokens, len(kept)
+
+    @staticmethod
+    def chunk_text(
+        text: str, max_tokens: int = None, overlap_tokens: int = None
+    ) -> list:
+        """Split text into manageable chunks"""
+        return list(PDFService.chunk_pages([text], max_tokens, overlap_tokens))
 
 
 pdf_service = PDFService()
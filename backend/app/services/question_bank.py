@@ -0,0 +1,198 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+
+from ..config import settings
+from ..models.schemas import KnowledgeMap, QuizQuestion, SubtopicQuestionRequest
+from ..services.backend_pool import background_priority
+from ..services.document_store import Document
+from ..services.knowledge_service import dedupe_questions, knowledge_service
+from ..utils.resilience import CircuitOpenError
+
+BankKey = Tuple[str, str]
+
+# Subtopics refilled together, so one round cannot hold the LLM for long
+FILL_BATCH_SUBTOPICS = 8
+# Most recent questions listed in a refill prompt as "do not repeat"
+PROMPT_EXISTING_QUESTIONS = 20
+
+
+class BankEntry:
+    """Banked questions for one subtopic and what is needed to refill them"""
+
+    def __init__(self, subtopic: SubtopicQuestionRequest, source: Optional[str]):
+        self.subtopic = subtopic
+        self.source = source
+        self.questions: Deque[QuizQuestion] = deque()
+        # Every question shown or banked, so refills never repeat one
+        self.asked: List[str] = list(subtopic.existing_questions)
+
+    def add(self, questions: List[QuizQuestion]) -> List[QuizQuestion]:
+        unique = dedupe_questions(questions, self.asked)
+        self.asked.extend(q.question for q in unique)
+        return unique
+
+
+class QuestionBank:
+    """Per-subtopic questions pre-generated with idle LLM capacity
+
+    Fills run in one background task at background priority, so they only
+    use Ollama slots that interactive requests leave free.
+    """
+
+    def __init__(
+        self, size: int = None, low_water: int = None, max_subtopics: int = None
+    ):
+        self.size = size or settings.QUESTION_BANK_SIZE
+        self.low_water = low_water or settings.QUESTION_BANK_LOW_WATER
+        self.max_subtopics = max_subtopics or settings.QUESTION_BANK_MAX_SUBTOPICS
+        self.enabled = settings.QUESTION_BANK_ENABLED
+        self._entries: "OrderedDict[BankKey, BankEntry]" = OrderedDict()
+        # Keys waiting for a refill, oldest request first
+        self._pending: "OrderedDict[BankKey, None]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.served = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(document_id: Optional[str], title: str) -> BankKey:
+        return document_id or "", " ".join(title.lower().split())
+
+    def fill_document(
+        self, document: Document, maps: Optional[List[KnowledgeMap]] = None
+    ) -> None:
+        """Bank questions for every subtopic of a processed document
+
+        maps defaults to the document's per-chunk maps, whose chunks are used
+        as source material.
+        """
+        if maps is None:
+            pairs = zip(document.maps, document.chunks)
+        else:
+            pairs = ((m, None) for m in maps)
+        for knowledge_map, source in pairs:
+            if knowledge_map is None:
+                continue
+            for sub in knowledge_map.subtopics:
+                self.register(
+                    self.key(document.document_id, sub.title),
+                    SubtopicQuestionRequest(
+                        title=sub.title,
+                        description=sub.description,
+                        key_concepts=sub.key_concepts,
+                        existing_questions=[q.question for q in sub.quiz],
+                    ),
+                    source,
+                )
+
+    def register(
+        self,
+        key: BankKey,
+        subtopic: SubtopicQuestionRequest,
+        source: Optional[str] = None,
+        served: Optional[List[QuizQuestion]] = None,
+    ) -> None:
+        """Track a subtopic and queue a refill; served questions are not repeated"""
+        if not self.enabled:
+            return
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = BankEntry(subtopic, source)
+            self._evict()
+        self._entries.move_to_end(key)
+        if served:
+            entry.add(served)
+        if len(entry.questions) < self.low_water:
+            self._request_fill(key)
+
+    def take(self, key: BankKey, count: int) -> Optional[List[QuizQuestion]]:
+        """Pop count banked questions, or None if the bank cannot cover them"""
+        entry = self._entries.get(key) if self.enabled else None
+        if entry is None or len(entry.questions) < count:
+            self.misses += 1
+            if entry is not None:
+                self._request_fill(key)
+            return None
+        self._entries.move_to_end(key)
+        questions = [entry.questions.popleft() for _ in range(count)]
+        self.served += 1
+        if len(entry.questions) < self.low_water:
+            self._request_fill(key)
+        return questions
+
+    def get_stats(self) -> dict:
+        return {
+            "subtopics": len(self._entries),
+            "questions": sum(len(e.questions) for e in self._entries.values()),
+            "pending_fills": len(self._pending),
+            "served": self.served,
+            "misses": self.misses,
+        }
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    def _request_fill(self, key: BankKey) -> None:
+        self._pending[key] = None
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_subtopics:
+            key, _ = self._entries.popitem(last=False)
+            self._pending.pop(key, None)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                keys = list(self._pending)[:FILL_BATCH_SUBTOPICS]
+                for key in keys:
+                    del self._pending[key]
+                keys = [k for k in keys if k in self._entries]
+                retry_after = await self._fill(keys)
+                if retry_after is not None:
+                    # Ollama is down; keep the keys queued and wait it out
+                    for key in keys:
+                        self._pending.setdefault(key, None)
+                    await asyncio.sleep(retry_after)
+
+    async def _fill(self, keys: List[BankKey]) -> Optional[int]:
+        """Top up the given subtopics; returns a retry delay if Ollama is down"""
+        entries = [self._entries[k] for k in keys]
+        count = max((self.size - len(e.questions) for e in entries), default=0)
+        if count <= 0:
+            return None
+
+        subtopics = [
+            e.subtopic.model_copy(
+                update={"existing_questions": e.asked[-PROMPT_EXISTING_QUESTIONS:]}
+            )
+            for e in entries
+        ]
+        try:
+            with background_priority():
+                results, _ = await knowledge_service.generate_question_batch(
+                    subtopics, count, [e.source for e in entries]
+                )
+        except CircuitOpenError as e:
+            return e.retry_after
+        except Exception as e:
+            print(f"Question bank fill failed: {e}")
+            return None
+
+        for entry, questions in zip(entries, results):
+            if questions is not None:
+                entry.questions.extend(entry.add(questions))
+        print(f"Question bank filled {len(entries)} subtopics")
+        return None
+
+
+question_bank = QuestionBank()
@@ -0,0 +1,154 @@
+import asyncio
+import re
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+
+from ..config import settings
+from ..services.ollama_service import ollama_service
+
+WORD = re.compile(r"[a-z][a-z'-]{2,}")
+# Table of contents / index lines: text followed by dot leaders or a page number
+TOC_LINE = re.compile(r"(\.{3,}|\s)\s*\d{1,4}\s*$")
+BOILERPLATE_HEADINGS = re.compile(
+    r"^\s*(table of contents|contents|index|bibliography|references|"
+    r"acknowledge?ments|copyright|about the author|preface|foreword)\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+STOPWORDS = frozenset(
+    """about above after again against all also and any are because been before
+    being below between both but can could did does doing down during each few
+    for from further had has have having her here hers him his how into its
+    itself just more most not now off once only other our ours out over own
+    same she should some such than that the their theirs them then there these
+    they this those through too under until very was were what when where
+    which while who whom why will with would you your yours""".split()
+)
+
+# Vocabulary cap for TF-IDF vectors, keeping the most widespread terms
+MAX_VOCABULARY = 5000
+
+
+def is_boilerplate(chunk: str) -> bool:
+    """Heuristic for tables of contents, indexes, reference lists and front matter"""
+    lines = [line for line in chunk.splitlines() if line.strip()]
+    if not lines:
+        return True
+    if BOILERPLATE_HEADINGS.search("\n".join(lines[:3])):
+        return True
+    toc_lines = sum(bool(TOC_LINE.search(line)) for line in lines)
+    if toc_lines / len(lines) > 0.4:
+        return True
+    words = WORD.findall(chunk.lower())
+    # Mostly numbers, symbols or single letters rather than prose
+    return len(words) < 0.3 * len(chunk.split())
+
+
+def tfidf_vectors(chunks: List[str]) -> np.ndarray:
+    """L2-normalised TF-IDF row vector per chunk"""
+    term_counts = [
+        Counter(w for w in WORD.findall(chunk.lower()) if w not in STOPWORDS)
+        for chunk in chunks
+    ]
+    document_frequency = Counter(term for counts in term_counts for term in counts)
+    vocabulary = {
+        term: index
+        for index, (term, _) in enumerate(
+            document_frequency.most_common(MAX_VOCABULARY)
+        )
+    }
+
+    matrix = np.zeros((len(chunks), len(vocabulary)), dtype=np.float32)
+    for row, counts in enumerate(term_counts):
+        for term, count in counts.items():
+            column = vocabulary.get(term)
+            if column is not None:
+                matrix[row, column] = count
+
+    df = np.array([document_frequency[term] for term in vocabulary], dtype=np.float32)
+    idf = np.log((1 + len(chunks)) / (1 + df)) + 1
+    matrix = np.log1p(matrix) * idf
+    return _normalize(matrix)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def max_marginal_relevance(
+    vectors: np.ndarray, k: int, diversity: float, candidates: List[int]
+) -> List[int]:
+    """Pick k rows that are central to the document but unlike each other
+
+    Relevance is similarity to the document centroid; each pick maximises
+    (1 - diversity) * relevance - diversity * similarity to earlier picks.
+    """
+    centroid = vectors[candidates].mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    relevance = vectors @ (centroid / norm) if norm else np.zeros(len(vectors))
+    similarity = vectors @ vectors.T
+
+    remaining = np.array(candidates)
+    redundancy = np.zeros(len(vectors))
+    selected = []
+    while remaining.size and len(selected) < k:
+        scores = (1 - diversity) * relevance[remaining] - diversity * redundancy[
+            remaining
+        ]
+        best = int(remaining[np.argmax(scores)])
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+        remaining = remaining[remaining != best]
+    return selected
+
+
+def best_matches(chunks: List[str], queries: List[str]) -> List[int]:
+    """Index of the chunk most similar to each query by TF-IDF cosine similarity"""
+    vectors = tfidf_vectors(chunks + queries)
+    similarity = vectors[len(chunks) :] @ vectors[: len(chunks)].T
+    return [int(i) for i in similarity.argmax(axis=1)]
+
+
+class SelectionService:
+    """Chooses which chunks of a document get knowledge maps within the LLM budget"""
+
+    async def vectors(self, chunks: List[str]) -> np.ndarray:
+        """Embeddings from Ollama when CHUNK_SELECTION is "embeddings", else TF-IDF"""
+        if settings.CHUNK_SELECTION == "embeddings":
+            embeddings = await ollama_service.embed(chunks, settings.OLLAMA_EMBED_MODEL)
+            if embeddings is not None:
+                return _normalize(np.asarray(embeddings, dtype=np.float32))
+            print("Embeddings unavailable, falling back to TF-IDF chunk selection")
+        return await asyncio.to_thread(tfidf_vectors, chunks)
+
+    async def select(
+        self, chunks: List[str], k: int, diversity: Optional[float] = None
+    ) -> List[int]:
+        """Indices of up to k representative, non-redundant chunks in document order
+
+        Boilerplate chunks are only used when there is nothing else to pick.
+        With CHUNK_SELECTION "first" this is the first k chunks.
+        """
+        if settings.CHUNK_SELECTION == "first" or len(chunks) <= k:
+            return list(range(min(k, len(chunks))))
+        if diversity is None:
+            diversity = settings.CHUNK_SELECTION_DIVERSITY
+
+        content = [i for i, chunk in enumerate(chunks) if not is_boilerplate(chunk)]
+        boilerplate = sorted(set(range(len(chunks))) - set(content))
+        if not content:
+            return boilerplate[:k]
+        vectors = await self.vectors(chunks)
+
+        selected = await asyncio.to_thread(
+            max_marginal_relevance, vectors, k, diversity, content
+        )
+        if len(selected) < k:
+            selected += boilerplate[: k - len(selected)]
+        return sorted(selected)
+
+
+selection_service = SelectionService()
@@ -0,0 +1,275 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import settings
+from ..utils import json_backend
+from ..services.metrics_service import registry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS slots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    backend TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    acquired REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    pid INTEGER PRIMARY KEY,
+    snapshot BLOB NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Milliseconds SQLite waits for another worker's write lock before failing
+BUSY_TIMEOUT_MS = 5000
+# Expired key-value rows are swept every this many writes
+SWEEP_EVERY_WRITES = 256
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedState:
+    """SQLite database coordinating the uvicorn worker processes on one host
+
+    Holds documents and job status any worker can serve, leases for the
+    global per-backend LLM concurrency limit and each worker's metrics. Only
+    used when WORKERS > 1; a single process keeps everything in memory.
+
+    SQLite may wait up to BUSY_TIMEOUT_MS for another worker's write lock,
+    so nothing touches the database on the event loop once started: reads
+    run in a thread, and writes are queued and committed in batches by a
+    writer task.
+    """
+
+    def __init__(self, path: str = None, enabled: bool = None):
+        self.path = path or settings.SHARED_STATE_PATH
+        self.enabled = settings.WORKERS > 1 if enabled is None else enabled
+        # Connections must not cross a fork or a thread, so each worker
+        # process and thread opens its own
+        self._local = threading.local()
+        self._writes = 0
+        # (statement, parameters) waiting for the writer task
+        self._pending: List[Tuple[str, tuple]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._closing = False
+        self._writer: Optional[asyncio.Task] = None
+        self._publisher: Optional[asyncio.Task] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def put(self, namespace: str, key: str, value: Any, ttl_seconds: float) -> None:
+        """Store a JSON-serializable value for ttl_seconds"""
+        self._write(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                namespace,
+                key,
+                json_backend.dumps_bytes(value),
+                time.time() + ttl_seconds,
+            ),
+        )
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self._get, namespace, key)
+
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        row = self.db.execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND expires >= ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return json_backend.loads(row[0]) if row else None
+
+    async def items(self, namespace: str) -> Dict[str, Any]:
+        """Every unexpired value in namespace, by key"""
+        return await asyncio.to_thread(self._items, namespace)
+
+    def _items(self, namespace: str) -> Dict[str, Any]:
+        return {
+            key: json_backend.loads(value)
+            for key, value in self.db.execute(
+                "SELECT key, value FROM kv WHERE namespace = ? AND expires >= ?",
+                (namespace, time.time()),
+            )
+        }
+
+    def touch_all(self, namespace: str, ttl_seconds: float) -> None:
+        """Extend the expiry of every value in namespace to ttl_seconds from now"""
+        self._write(
+            "UPDATE kv SET expires = ? WHERE namespace = ?",
+            (time.time() + ttl_seconds, namespace),
+        )
+
+    def touch(self, namespace: str, key: str, ttl_seconds: float) -> None:
+        """Extend a value's expiry to ttl_seconds from now"""
+        self._write(
+            "UPDATE kv SET expires = ? WHERE namespace = ? AND key = ?",
+            (time.time() + ttl_seconds, namespace, key),
+        )
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._write("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def try_acquire_slot(self, backend: str, limit: int) -> Optional[int]:
+        """Lease one of limit LLM slots on backend across all workers
+
+        Returns the lease id, or None when every slot is taken. Leases of
+        workers that died without releasing them are reclaimed first.
+        Blocking; call it off the event loop.
+        """
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            pids = [row[0] for row in db.execute("SELECT DISTINCT pid FROM slots")]
+            for pid in pids:
+                if not _pid_alive(pid):
+                    db.execute("DELETE FROM slots WHERE pid = ?", (pid,))
+            (taken,) = db.execute(
+                "SELECT COUNT(*) FROM slots WHERE backend = ?", (backend,)
+            ).fetchone()
+            slot_id = None
+            if taken < limit:
+                slot_id = db.execute(
+                    "INSERT INTO slots (backend, pid, acquired) VALUES (?, ?, ?)",
+                    (backend, os.getpid(), time.time()),
+                ).lastrowid
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return slot_id
+
+    def release_slot(self, slot_id: int) -> None:
+        self._write("DELETE FROM slots WHERE id = ?", (slot_id,))
+
+    async def slots_in_use(self) -> Dict[str, int]:
+        """Leased LLM slots per backend, over all workers"""
+        return await asyncio.to_thread(
+            lambda: dict(
+                self.db.execute("SELECT backend, COUNT(*) FROM slots GROUP BY backend")
+            )
+        )
+
+    def publish_metrics(self, snapshot: dict) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO metrics (pid, snapshot, updated) VALUES (?, ?, ?)",
+            (os.getpid(), json_backend.dumps_bytes(snapshot), time.time()),
+        )
+
+    async def metrics_snapshots(self) -> List[dict]:
+        """Latest metrics snapshot of every other worker of this run, including exited ones"""
+        rows = await asyncio.to_thread(
+            lambda: self.db.execute(
+                "SELECT snapshot FROM metrics WHERE pid != ?", (os.getpid(),)
+            ).fetchall()
+        )
+        return [json_backend.loads(row[0]) for row in rows]
+
+    def start(self) -> None:
+        """Drop state left by earlier processes and start the writer and metrics publisher
+
+        Leases of an earlier process with this pid are released, and metrics
+        of processes no longer running, from earlier runs of the server, are
+        discarded so they are not added to this run's.
+        """
+        if not self.enabled:
+            return
+        self.db.execute("DELETE FROM slots WHERE pid = ?", (os.getpid(),))
+        pids = [row[0] for row in self.db.execute("SELECT pid FROM metrics")]
+        for pid in pids:
+            if pid == os.getpid() or not _pid_alive(pid):
+                self.db.execute("DELETE FROM metrics WHERE pid = ?", (pid,))
+        if self._writer is None or self._writer.done():
+            self._wake = asyncio.Event()
+            self._closing = False
+            self._writer = asyncio.create_task(self._write_loop())
+        if self._publisher is None or self._publisher.done():
+            self._publisher = asyncio.create_task(self._publish_loop())
+
+    async def stop(self) -> None:
+        """Publish final metrics and commit every queued write"""
+        if self._publisher is not None:
+            self._publisher.cancel()
+            await asyncio.gather(self._publisher, return_exceptions=True)
+            self._publisher = None
+        if self.enabled:
+            self.publish_metrics(registry.snapshot())
+        if self._writer is not None:
+            self._closing = True
+            self._wake.set()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+
+    def _write(self, statement: str, parameters: tuple) -> None:
+        """Queue a write for the writer task, or run it now when none is running"""
+        if self._writer is None or self._writer.done():
+            self._commit([(statement, parameters)])
+            return
+        self._pending.append((statement, parameters))
+        self._wake.set()
+
+    def _commit(self, writes: List[Tuple[str, tuple]]) -> None:
+        """Apply writes in one transaction"""
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for statement, parameters in writes:
+                db.execute(statement, parameters)
+            sweeps = self._writes // SWEEP_EVERY_WRITES
+            self._writes += len(writes)
+            if self._writes // SWEEP_EVERY_WRITES > sweeps:
+                db.execute("DELETE FROM kv WHERE expires < ?", (time.time(),))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    async def _write_loop(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            writes, self._pending = self._pending, []
+            if writes:
+                try:
+                    await asyncio.to_thread(self._commit, writes)
+                except sqlite3.Error as e:
+                    print(f"Failed to write {len(writes)} changes to shared state: {e}")
+            if self._closing and not self._pending:
+                return
+
+    async def _publish_loop(self) -> None:
+        while True:
+            self.publish_metrics(registry.snapshot())
+            await asyncio.sleep(settings.METRICS_SYNC_INTERVAL_SECONDS)
+
+
+shared_state = SharedState()
@@ -0,0 +1,106 @@
+import difflib
+from typing import Dict, List, Optional
+
+from ..models.schemas import KnowledgeMap
+from ..services.cache_service import cache_service, content_hash
+from ..services.document_store import Document, document_store
+from ..services.knowledge_service import PROMPT_VERSION
+from ..services.ollama_service import ollama_service
+
+
+class DocumentVersion:
+    """Page and chunk fingerprints and valid maps of one processed upload"""
+
+    def __init__(
+        self, page_hashes: List[str], anchors: List[str], maps: Dict[str, str]
+    ):
+        self.page_hashes = page_hashes
+        # Chunk start anchors of the whole document, in order
+        self.anchors = anchors
+        # Chunk fingerprint -> knowledge map JSON
+        self.maps = maps
+
+    def to_dict(self) -> dict:
+        return {
+            "page_hashes": self.page_hashes,
+            "anchors": self.anchors,
+            "maps": self.maps,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DocumentVersion":
+        return cls(data["page_hashes"], data["anchors"], data["maps"])
+
+
+class VersionStore:
+    """Last processed version of each uploaded file, for incremental re-uploads
+
+    Versions are kept in the result cache by filename, model and prompt
+    version, so they survive restarts and are off when caching is disabled.
+    """
+
+    def __init__(self):
+        self.cache = cache_service
+
+    def _key(self, filename: str) -> str:
+        return self.cache.key(
+            "document_version", ollama_service.model, PROMPT_VERSION, filename
+        )
+
+    @staticmethod
+    def fingerprint(text: str) -> str:
+        return content_hash(text)
+
+    def previous(self, filename: str) -> Optional[DocumentVersion]:
+        data = self.cache.get(self._key(filename))
+        return DocumentVersion.from_dict(data) if data is not None else None
+
+    @staticmethod
+    def changed_pages(previous: DocumentVersion, page_hashes: List[str]) -> int:
+        """Number of pages added or edited since the previous version"""
+        matcher = difflib.SequenceMatcher(
+            None, previous.page_hashes, page_hashes, autojunk=False
+        )
+        unchanged = sum(block.size for block in matcher.get_matching_blocks())
+        return len(page_hashes) - unchanged
+
+    def reuse_maps(self, document: Document, previous: DocumentVersion) -> int:
+        """Copy maps of chunks unchanged since the previous version into document
+
+        Returns the number of maps copied.
+        """
+        reused = 0
+        for index, chunk in enumerate(document.chunks):
+            map_json = previous.maps.get(self.fingerprint(chunk))
+            if map_json is not None:
+                document_store.set_map(
+                    document.document_id,
+                    index,
+                    KnowledgeMap.model_validate_json(map_json),
+                )
+                reused += 1
+        return reused
+
+    def save(self, document: Document) -> None:
+        """Record the document's fingerprints and valid maps as its latest version
+
+        Maps of the previous version are kept for chunks that are still present.
+        A document without page fingerprints is not recorded, so it cannot
+        replace a complete version.
+        """
+        if not document.page_hashes:
+            print(f"Not recording a version of {document.filename}: no fingerprints")
+            return
+        previous = self.previous(document.filename)
+        maps = {}
+        for chunk, knowledge_map in zip(document.chunks, document.maps):
+            key = self.fingerprint(chunk)
+            if knowledge_map is not None:
+                maps[key] = knowledge_map.model_dump_json()
+            elif previous is not None and key in previous.maps:
+                maps[key] = previous.maps[key]
+        version = DocumentVersion(document.page_hashes, document.anchors, maps)
+        self.cache.set(self._key(document.filename), version.to_dict())
+
+
+version_store = VersionStore()
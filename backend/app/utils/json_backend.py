@@ -0,0 +1,24 @@
+import json
+from typing import Any
+
+from ..config import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# orjson is used for decode/encode when installed and JSON_BACKEND allows it
+use_orjson = orjson is not None and settings.JSON_BACKEND != "std"
+
+
+def loads(data) -> Any:
+    if use_orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_bytes(value: Any) -> bytes:
+    if use_orjson:
+        return orjson.dumps(value)
+    return json.dumps(value).encode()
@@ -0,0 +1,152 @@
+import re
+from typing import Optional
+
+_LITERAL = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?|true|false|null")
+_LITERAL_CHARS = set("0123456789+-.eEtrufalsn")
+
+# Parser expectations between tokens
+_VALUE = "value"
+_VALUE_OR_END = "value_or_end"
+_KEY = "key"
+_KEY_OR_END = "key_or_end"
+_COLON = "colon"
+_COMMA_OR_END = "comma_or_end"
+_DONE = "done"
+
+
+class IncrementalJSONParser:
+    """Checks JSON structure as text streams in, without building the value
+
+    feed() returns False as soon as the text can no longer be valid JSON, so a
+    generation can be aborted early. Once the top-level value closes,
+    `complete` is set and `text` holds the document without trailing output.
+    """
+
+    def __init__(self, expected_start: Optional[str] = None):
+        # "{" or "[" to require a particular top-level container
+        self.expected_start = expected_start
+        self.error: Optional[str] = None
+        self.complete = False
+        self._parts = []
+        self._length = 0
+        self._end: Optional[int] = None
+        self._stack = []
+        self._expect = _VALUE
+        self._in_string = False
+        self._string_is_key = False
+        self._escape = False
+        self._literal = []
+
+    @property
+    def text(self) -> str:
+        text = "".join(self._parts)
+        return text if self._end is None else text[: self._end]
+
+    def feed(self, chunk: str) -> bool:
+        if self.error or self.complete:
+            return self.error is None
+        self._parts.append(chunk)
+        for offset, char in enumerate(chunk):
+            if not self._consume(char):
+                return False
+            if self.complete:
+                self._end = self._length + offset + 1
+                break
+        self._length += len(chunk)
+        return True
+
+    def _fail(self, message: str) -> bool:
+        self.error = message
+        return False
+
+    def _value_done(self) -> bool:
+        if not self._stack:
+            self.complete = True
+            self._expect = _DONE
+        else:
+            self._expect = _COMMA_OR_END
+        return True
+
+    def _end_literal(self) -> bool:
+        literal = "".join(self._literal)
+        self._literal = []
+        if not _LITERAL.fullmatch(literal):
+            return self._fail(f"Invalid literal {literal!r}")
+        return self._value_done()
+
+    def _consume(self, char: str) -> bool:
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._string_is_key:
+                    self._expect = _COLON
+                    return True
+                return self._value_done()
+            elif char < " ":
+                return self._fail("Control character in string")
+            return True
+
+        if self._literal:
+            if char in _LITERAL_CHARS:
+                self._literal.append(char)
+                return True
+            if not self._end_literal():
+                return False
+            if self.complete:
+                return True
+
+        if char.isspace():
+            return True
+
+        expect = self._expect
+        if expect in (_VALUE, _VALUE_OR_END):
+            if not self._stack and self.expected_start and char != self.expected_start:
+                return self._fail(f"Expected {self.expected_start!r}, got {char!r}")
+            if char == "]" and expect == _VALUE_OR_END:
+                self._stack.pop()
+                return self._value_done()
+            if char == "{":
+                self._stack.append("}")
+                self._expect = _KEY_OR_END
+            elif char == "[":
+                self._stack.append("]")
+                self._expect = _VALUE_OR_END
+            elif char == '"':
+                self._in_string = True
+                self._string_is_key = False
+            elif char in _LITERAL_CHARS:
+                self._literal.append(char)
+            else:
+                return self._fail(f"Unexpected {char!r} where a value was expected")
+            return True
+
+        if expect in (_KEY, _KEY_OR_END):
+            if char == "}" and expect == _KEY_OR_END:
+                self._stack.pop()
+                return self._value_done()
+            if char != '"':
+                return self._fail(f"Unexpected {char!r} where a key was expected")
+            self._in_string = True
+            self._string_is_key = True
+            return True
+
+        if expect == _COLON:
+            if char != ":":
+                return self._fail(f"Expected ':', got {char!r}")
+            self._expect = _VALUE
+            return True
+
+        if expect == _COMMA_OR_END:
+            if char == ",":
+                self._expect = _KEY if self._stack[-1] == "}" else _VALUE
+                return True
+            if char == self._stack[-1]:
+                self._stack.pop()
+                return self._value_done()
+            return self._fail(f"Unexpected {char!r} after a value")
+
+        return True
@@ -0,0 +1,102 @@
+import random
+import time
+from typing import Optional
+
+from ..config import settings
+
+
+def backoff_delay(
+    attempt: int, base: Optional[float] = None, cap: Optional[float] = None
+) -> float:
+    """Seconds to wait before retry number attempt (0-based), with full jitter"""
+    base = settings.RETRY_BACKOFF_BASE_SECONDS if base is None else base
+    cap = settings.RETRY_BACKOFF_MAX_SECONDS if cap is None else cap
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend that is known to be down"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Ollama is unavailable")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fails fast after repeated failures, letting one trial call through per reset period
+
+    closed: calls pass. open: calls raise CircuitOpenError until reset_seconds
+    have passed. half_open: a single trial call decides whether to close or
+    reopen the circuit.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: Optional[int] = None,
+        reset_seconds: Optional[float] = None,
+        name: str = "Ollama",
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_seconds = reset_seconds or settings.CIRCUIT_RESET_SECONDS
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def retry_after(self) -> int:
+        remaining = self._opened_at + self.reset_seconds - time.monotonic()
+        return max(1, int(remaining + 0.999))
+
+    def available(self) -> bool:
+        """Whether check() would let a call through, without claiming the trial"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self._opened_at >= self.reset_seconds
+        return not self._trial_in_flight
+
+    def check(self) -> None:
+        """Raise CircuitOpenError if a call should not be attempted now"""
+        if self.state == "closed":
+            return
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                raise CircuitOpenError(self.retry_after())
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self._trial_in_flight:
+            raise CircuitOpenError(self.retry_after())
+        self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            print(f"{self.name} circuit closed")
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def half_open(self) -> None:
+        """Let the next call through as a trial now, e.g. after a health check passed"""
+        if self.state == "open":
+            print(f"{self.name} circuit half-open")
+            self.state = "half_open"
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        """Give back a trial call that ended without an outcome, e.g. cancelled"""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self) -> None:
+        """Open the circuit immediately"""
+        if self.state != "open":
+            print(f"{self.name} circuit opened for {self.reset_seconds}s")
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._trial_in_flight = False
@@ -0,0 +1,94 @@
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, Generic, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Stream(Generic[T]):
+    """One shared in-flight stream, buffered so late subscribers can replay it"""
+
+    def __init__(self, source: AsyncIterator[T], on_join: Optional[Callable[[], None]]):
+        self.on_join = on_join
+        self.items: List[T] = []
+        self.error = None
+        self.done = False
+        self.subscribers = 0
+        # Replaced after every item, so each wait sees the next change
+        self.changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+
+    def _notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def _pump(self, source: AsyncIterator[T]) -> None:
+        try:
+            async with aclosing(source):
+                async for item in source:
+                    self.items.append(item)
+                    self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+
+class SingleFlight:
+    """Coalesces concurrent streams with the same key into one underlying stream
+
+    The stream runs in its own task, so a cancelled or disconnected
+    subscriber does not cancel it while others still read it; it is cancelled
+    once the last subscriber has gone. Finished streams are forgotten, so
+    later callers with the same key start a new one.
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, _Stream] = {}
+
+    async def stream(
+        self,
+        key: str,
+        fn: Callable[[], AsyncIterator[T]],
+        on_join: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[T]:
+        """Iterate fn(), or subscribe to the identical stream already in flight
+
+        A subscriber that joins late first receives every item so far. One
+        that stops early detaches the stream from key, so its retry starts a
+        fresh call instead of rejoining output it gave up on. on_join, as
+        passed by the caller that started the stream, is called from each
+        subscriber that joins it later.
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = self._streams[key] = _Stream(fn(), on_join)
+            flight.task.add_done_callback(
+                lambda _: self._forget(self._streams, key, flight)
+            )
+        elif flight.on_join is not None:
+            flight.on_join()
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.items):
+                    yield flight.items[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            # Finished, or given up on by this subscriber: no longer joinable
+            self._forget(self._streams, key, flight)
+            if flight.subscribers == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    @staticmethod
+    def _forget(flights: Dict[str, object], key: str, flight: object) -> None:
+        if flights.get(key) is flight:
+            del flights[key]
@@ -0,0 +1,61 @@
+from functools import lru_cache
+from typing import Protocol
+
+from ..config import settings
+
+
+class TokenCounter(Protocol):
+    def count(self, text: str) -> int: ...
+
+
+class ApproximateTokenCounter:
+    """Fast character-based estimate (roughly 4 characters per token)"""
+
+    def __init__(self, chars_per_token: float = 4.0):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return -int(-len(text) // self.chars_per_token)
+
+
+class HuggingFaceTokenCounter:
+    """Exact counts using the model's tokenizer from the `tokenizers` package"""
+
+    def __init__(self, name: str):
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_pretrained(name)
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+@lru_cache(maxsize=1)
+def get_token_counter() -> TokenCounter:
+    """Token counter selected by TOKEN_COUNTER, falling back to the approximation"""
+    if settings.TOKEN_COUNTER == "huggingface":
+        try:
+            return HuggingFaceTokenCounter(settings.TOKENIZER_NAME)
+        except Exception as e:
+            print(f"Tokenizer {settings.TOKENIZER_NAME} unavailable ({e})")
+            print("Falling back to approximate token counting")
+    return ApproximateTokenCounter()
+
+
+def truncate_to_tokens(text: str, max_tokens: int, counter: TokenCounter = None) -> str:
+    """Longest prefix of text that is at most max_tokens tokens long"""
+    if counter is None:
+        counter = get_token_counter()
+    if max_tokens <= 0:
+        return ""
+    if counter.count(text) <= max_tokens:
+        return text
+    # Binary search on length: text[:low] fits, text[:high] does not
+    low, high = 0, len(text)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if counter.count(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle
+    return text[:low]
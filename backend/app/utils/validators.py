@@ -1,88 +1,142 @@
-import json
+from typing import Dict, List
+
+from pydantic import TypeAdapter, ValidationError
+
+from ..models.schemas import DocumentSummary, KnowledgeMap, QuizQuestion
+
+_questions_adapter = TypeAdapter(List[QuizQuestion])
+_question_batch_adapter = TypeAdapter(Dict[str, List[QuizQuestion]])
+
+
+class ResponseValidationError(ValueError):
+    """A model response that could not be parsed into the expected schema"""
+
+    def __init__(self, message: str, errors: List[dict] = None):
+        super().__init__(message)
+        self.errors = errors or []
+
+    def to_detail(self) -> dict:
+        return {"message": str(self), "errors": self.errors}
+
+
+def _pydantic_errors(e: ValidationError) -> List[dict]:
+    return [
+        {"loc": list(error["loc"]), "msg": error["msg"]}
+        for error in e.errors(include_url=False, include_input=False)
+    ]
+
+
+def _empty_question_fields(
+    questions: List[QuizQuestion], loc: list = None
+) -> List[dict]:
+    return [
+        {"loc": [*(loc or []), i, field], "msg": f"'{field}' is empty"}
+        for i, q in enumerate(questions)
+        for field in ("question", "options", "answer", "explanation")
+        if not getattr(q, field) or not str(getattr(q, field)).strip()
+    ]
+
+
+def parse_knowledge_map(json_str: str) -> KnowledgeMap:
+    """Parse and validate a knowledge map JSON string in a single pass"""
+    try:
+        knowledge_map = KnowledgeMap.model_validate_json(json_str)
+    except ValidationError as e:
+        errors = _pydantic_errors(e)
+        print(f"Validation failed: {errors[:3]}")
+        raise ResponseValidationError("Invalid knowledge map", errors) from None
+
+    errors = [
+        {
+            "loc": ["subtopics", i, "quiz", j, "explanation"],
+            "msg": "Explanation is empty",
+        }
+        for i, sub in enumerate(knowledge_map.subtopics)
+        for j, q in enumerate(sub.quiz)
+        if not q.explanation.strip()
+    ]
+    if errors:
+        print(f"Validation failed: {errors[:3]}")
+        raise ResponseValidationError("Invalid knowledge map", errors)
+    return knowledge_map
+
+
+def parse_document_summary(json_str: str) -> DocumentSummary:
+    """Parse and validate a chunk or merged summary JSON string"""
+    try:
+        summary = DocumentSummary.model_validate_json(json_str)
+    except ValidationError as e:
+        errors = _pydantic_errors(e)
+        print(f"Validation failed: {errors[:3]}")
+        raise ResponseValidationError("Invalid summary", errors) from None
+
+    errors = [
+        {"loc": ["sections", i, "title"], "msg": "Title is empty"}
+        for i, section in enumerate(summary.sections)
+        if not section.title.strip()
+    ]
+    if not summary.sections:
+        errors.append({"loc": ["sections"], "msg": "No sections"})
+    if errors:
+        print(f"Validation failed: {errors[:3]}")
+        raise ResponseValidationError("Invalid summary", errors)
+    return summary
+
+
+def parse_questions(json_str: str) -> List[QuizQuestion]:
+    """Parse and validate a questions JSON string in a single pass"""
+    try:
+        questions = _questions_adapter.validate_json(json_str)
+    except ValidationError as e:
+        errors = _pydantic_errors(e)
+        print(f"Validation failed: {errors[:3]}")
+        print(f"Raw response: {json_str[:200]}...")
+        raise ResponseValidationError("Invalid questions", errors) from None
+
+    errors = _empty_question_fields(questions)
+    if errors:
+        print(f"Validation failed: {errors[:3]}")
+        raise ResponseValidationError("Invalid questions", errors)
+
+    print(f"Validation passed: {len(questions)} questions are valid")
+    return questions
+
+
+def parse_question_batch(
+    json_str: str, keys: List[str]
+) -> Dict[str, List[QuizQuestion]]:
+    """Parse a JSON object mapping each of the given keys to a list of questions"""
+    try:
+        batch = _question_batch_adapter.validate_json(json_str)
+    except ValidationError as e:
+        errors = _pydantic_errors(e)
+        print(f"Validation failed: {errors[:3]}")
+        raise ResponseValidationError("Invalid question batch", errors) from None
+
+    errors = [
+        {"loc": [key], "msg": "Missing subtopic"} for key in keys if key not in batch
+    ]
+    for key in keys:
+        errors.extend(_empty_question_fields(batch.get(key, []), [key]))
+    if errors:
+        print(f"Validation failed: {errors[:3]}")
+        raise ResponseValidationError("Invalid question batch", errors)
+    return {key: batch[key] for key in keys}
 
 
 def validate_knowledge_map(json_str: str) -> bool:
     """Validate that a knowledge map JSON string is properly formatted"""
     try:
-        parsed = json.loads(json_str)
-
-        # Check required top-level fields
-        if not isinstance(parsed, dict):
-            print("Validation failed: Response is not an object")
-            return False
-
-        if "topic" not in parsed or "subtopics" not in parsed:
-            print("Validation failed: Missing required fields")
-            return False
-
-        # Check subtopics
-        subtopics = parsed.get("subtopics", [])
-        if not isinstance(subtopics, list):
-            print("Validation failed: subtopics is not a list")
-            return False
-
-        for i, sub in enumerate(subtopics):
-            if not isinstance(sub, dict):
-                print(f"Validation failed: Subtopic {i} is not an object")
-                return False
-
-            required_fields = ["title", "description", "key_concepts", "status", "quiz"]
-            for field in required_fields:
-                if field not in sub:
-                    print(f"Validation failed: Subtopic {i} missing '{field}' field")
-                    return False
-
-            # Validate quiz questions
-            for j, q in enumerate(sub.get("quiz", [])):
-                if not isinstance(q, dict):
-                    print(
-                        f"Validation failed: Question {j} in subtopic {i} is not an object"
-                    )
-                    return False
-
-                if "explanation" not in q or not q["explanation"].strip():
-                    print(
-                        f"Validation failed: Question {j} in subtopic {i} missing explanation"
-                    )
-                    return False
-
+        parse_knowledge_map(json_str)
         return True
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        return False
-    except Exception as e:
-        print(f"Validation error: {e}")
+    except ResponseValidationError:
         return False
 
 
 def validate_questions(json_str: str) -> bool:
     """Validate that a questions JSON string is properly formatted"""
     try:
-        questions = json.loads(json_str)
-        if not isinstance(questions, list):
-            print("Validation failed: Response is not a list")
-            return False
-
-        for i, q in enumerate(questions):
-            if not isinstance(q, dict):
-                print(f"Validation failed: Question {i} is not an object")
-                return False
-
-            required_fields = ["question", "options", "answer", "explanation"]
-            for field in required_fields:
-                if field not in q:
-                    print(f"Validation failed: Question {i} missing '{field}' field")
-                    return False
-                if not q[field] or not str(q[field]).strip():
-                    print(f"Validation failed: Question {i} has empty '{field}' field")
-                    return False
-
-        print(f"Validation passed: {len(questions)} questions are valid")
+        parse_questions(json_str)
         return True
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        print(f"Raw response: {json_str[:200]}...")
-        return False
-    except Exception as e:
-        print(f"Validation error: {e}")
+    except ResponseValidationError:
         return False
@@ -0,0 +1,145 @@
+import json
+import os
+import random
+from typing import List
+
+import fitz
+
+WORDS = (
+    "analysis system model process energy cell structure function network data "
+    "theory method result protein signal memory learning pattern feedback layer "
+    "variable equation gradient market policy history culture language evidence "
+    "experiment sample measure control factor response growth change level rate"
+).split()
+
+LAYOUTS = ("prose", "columns", "outline")
+
+# Generated PDFs are kept here between runs
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), ".fixtures")
+
+PAGE_RECT = fitz.Rect(0, 0, 612, 792)
+MARGIN = 54
+FONT = fitz.Font("helv")
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(WORDS, k=rng.randint(8, 22))
+    return " ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"])
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+
+def _prose_page(page: fitz.Page, rng: random.Random) -> None:
+    text = "\n\n".join(_paragraph(rng, rng.randint(3, 6)) for _ in range(4))
+    page.insert_textbox(
+        fitz.Rect(MARGIN, MARGIN, PAGE_RECT.width - MARGIN, PAGE_RECT.height - MARGIN),
+        text,
+        fontsize=10,
+    )
+
+
+def _columns_page(page: fitz.Page, rng: random.Random) -> None:
+    middle = PAGE_RECT.width / 2
+    for left, right in ((MARGIN, middle - 12), (middle + 12, PAGE_RECT.width - MARGIN)):
+        text = "\n\n".join(_paragraph(rng, rng.randint(2, 4)) for _ in range(4))
+        page.insert_textbox(
+            fitz.Rect(left, MARGIN, right, PAGE_RECT.height - MARGIN), text, fontsize=8
+        )
+
+
+def _outline_page(page: fitz.Page, rng: random.Random) -> None:
+    writer = fitz.TextWriter(page.rect)
+    y = MARGIN
+    while y < PAGE_RECT.height - 2 * MARGIN:
+        writer.append((MARGIN, y), rng.choice(WORDS).title(), font=FONT, fontsize=14)
+        y += 22
+        for _ in range(rng.randint(2, 5)):
+            line = "- " + _sentence(rng)[:80]
+            writer.append((MARGIN + 18, y), line, font=FONT, fontsize=9)
+            y += 14
+        y += 10
+    writer.write_text(page)
+
+
+_RENDERERS = {"prose": _prose_page, "columns": _columns_page, "outline": _outline_page}
+
+
+def make_pdf(pages: int, layout: str = "prose", seed: int = 0) -> bytes:
+    """Deterministic synthetic PDF with the given page count and layout"""
+    rng = random.Random(f"{layout}-{pages}-{seed}")
+    render = _RENDERERS[layout]
+    doc = fitz.open()
+    try:
+        for _ in range(pages):
+            render(doc.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height), rng)
+        return doc.tobytes(garbage=3, deflate=True)
+    finally:
+        doc.close()
+
+
+def load_pdf(
+    pages: int, layout: str = "prose", seed: int = 0, cache_dir: str = FIXTURE_DIR
+) -> bytes:
+    """make_pdf, reusing a previously generated file from cache_dir"""
+    path = os.path.join(cache_dir, f"{layout}-{pages}p-{seed}.pdf")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    data = make_pdf(pages, layout, seed)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+
+def make_question(rng: random.Random) -> dict:
+    options = [f"{letter}. {' '.join(rng.choices(WORDS, k=4))}" for letter in "ABCD"]
+    return {
+        "question": _sentence(rng)[:-1] + "?",
+        "options": options,
+        "answer": rng.choice(options),
+        "explanation": _sentence(rng),
+    }
+
+
+def make_questions_json(count: int, seed: int = 0) -> str:
+    """Synthetic model output for the questions prompt"""
+    rng = random.Random(f"questions-{count}-{seed}")
+    return json.dumps([make_question(rng) for _ in range(count)], indent=2)
+
+
+def make_knowledge_map_json(
+    subtopics: int, questions_per_subtopic: int = 3, seed: int = 0
+) -> str:
+    """Synthetic model output for the knowledge map prompt"""
+    rng = random.Random(f"map-{subtopics}-{questions_per_subtopic}-{seed}")
+    return json.dumps(
+        {
+            "topic": " ".join(rng.choices(WORDS, k=3)).title(),
+            "subtopics": [
+                {
+                    "title": " ".join(rng.choices(WORDS, k=2)).title(),
+                    "description": _sentence(rng),
+                    "key_concepts": rng.sample(WORDS, 3),
+                    "status": "unmastered",
+                    "quiz": [make_question(rng) for _ in range(questions_per_subtopic)],
+                }
+                for _ in range(subtopics)
+            ],
+        },
+        indent=2,
+    )
+
+
+def tokenize_like_model(text: str, seed: int = 0) -> List[str]:
+    """Split text into 1-8 character pieces, roughly like streamed model tokens"""
+    rng = random.Random(seed)
+    pieces = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 8)
+        pieces.append(text[position : position + size])
+        position += size
+    return pieces
@@ -0,0 +1,290 @@
+"""Benchmarks for the PDF extraction, chunking and response validation hot paths
+
+Run from the repository root:
+
+    python -m backend.benchmarks.run                  # compare with baseline.json
+    python -m backend.benchmarks.run --quick          # small cases only
+    python -m backend.benchmarks.run --save-baseline  # record a new baseline
+    python -m backend.benchmarks.run --strict         # exit 1 on regressions
+
+Synthetic PDFs are generated once and kept in benchmarks/.fixtures. Each
+case reports the median and fastest wall time per call over --repeat
+samples, and the peak Python heap allocation (tracemalloc) of one extra
+call. Regressions are judged on the fastest sample, which is the least
+affected by other load on the machine. Native allocations
+inside PyMuPDF and memory used by extraction worker processes are not
+included. A case is flagged when it is slower or larger than the
+baseline by more than the tolerance and by more than an absolute noise
+floor, so timer jitter on microsecond-scale cases is not reported.
+Baselines are machine specific, so the comparison is a report; only with
+--strict, on the machine that recorded the baseline, does a regression
+make the exit status 1.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import fitz
+from fastapi import UploadFile
+
+from ..app.services.cache_service import cache_service
+from ..app.services.pdf_service import PDFService, shutdown_executor
+from ..app.utils.json_stream import IncrementalJSONParser
+from ..app.utils.validators import validate_knowledge_map, validate_questions
+from . import fixtures
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+PAGE_COUNTS = (10, 100, 500, 2000)
+QUICK_PAGE_COUNTS = (10, 100)
+# Fast cases are looped until one timing sample takes at least this long
+MIN_SAMPLE_SECONDS = 0.02
+
+Case = Tuple[str, Callable[[], object]]
+
+
+def _extract_cases(
+    loop: asyncio.AbstractEventLoop, page_counts, layouts
+) -> Tuple[List[Case], Dict[str, str]]:
+    """Extraction cases, plus the extracted text of each PDF for chunking"""
+    cases = []
+    texts = {}
+    for layout in layouts:
+        for pages in page_counts:
+            data = fixtures.load_pdf(pages, layout)
+            name = f"{layout}-{pages}p"
+
+            def extract(data=data) -> str:
+                upload = UploadFile(file=io.BytesIO(data), filename="bench.pdf")
+                return loop.run_until_complete(PDFService.extract_text_from_pdf(upload))
+
+            cases.append((f"extract/{name}", extract))
+            texts[name] = extract()
+    return cases, texts
+
+
+def _chunk_cases(texts: Dict[str, str]) -> List[Case]:
+    return [
+        (f"chunk/{name}", lambda text=text: PDFService.chunk_text(text))
+        for name, text in texts.items()
+    ]
+
+
+def _validation_cases() -> List[Case]:
+    cases = []
+    for subtopics in (5, 50):
+        map_json = fixtures.make_knowledge_map_json(subtopics)
+        cases.append(
+            (
+                f"validate_map/{subtopics}-subtopics",
+                lambda map_json=map_json: validate_knowledge_map(map_json),
+            )
+        )
+
+    broken = json.loads(fixtures.make_knowledge_map_json(50))
+    broken["subtopics"][-1]["quiz"][-1]["explanation"] = ""
+    broken_json = json.dumps(broken)
+    cases.append(
+        (
+            "validate_map/50-subtopics-invalid",
+            lambda: validate_knowledge_map(broken_json),
+        )
+    )
+
+    for count in (3, 50):
+        questions_json = fixtures.make_questions_json(count)
+        cases.append(
+            (
+                f"validate_questions/{count}",
+                lambda questions_json=questions_json: validate_questions(
+                    questions_json
+                ),
+            )
+        )
+
+    tokens = fixtures.tokenize_like_model(fixtures.make_knowledge_map_json(50))
+
+    def stream_parse() -> bool:
+        parser = IncrementalJSONParser("{")
+        for token in tokens:
+            if not parser.feed(token) or parser.complete:
+                break
+        return parser.complete
+
+    cases.append(("stream_parse/50-subtopics", stream_parse))
+    return cases
+
+
+def _time(fn: Callable[[], object], number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - start
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    """Median and min seconds per call over repeat samples, then peak heap of one traced call"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        number = 1
+        while _time(fn, number) < MIN_SAMPLE_SECONDS:
+            number *= 10
+        times = [_time(fn, number) / number for _ in range(repeat)]
+
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def compare(
+    results: Dict[str, dict],
+    baseline: Dict[str, dict],
+    time_tolerance: float,
+    memory_tolerance: float,
+    min_time_delta: float = 0.0,
+    min_memory_delta: float = 0.0,
+) -> List[str]:
+    """Print a results table and return the names of regressed cases"""
+    regressions = []
+    print(
+        f"{'case':40} {'median s':>10} {'min s':>10} {'vs base':>8} {'peak KB':>11} {'vs base':>8}"
+    )
+    for name, result in results.items():
+        base = baseline.get(name)
+        time_change = memory_change = ""
+        flag = ""
+        if base:
+            time_ratio = result["min_seconds"] / base["min_seconds"] - 1
+            memory_ratio = (
+                result["peak_kb"] / base["peak_kb"] - 1 if base["peak_kb"] else 0.0
+            )
+            time_change = f"{time_ratio:+.0%}"
+            memory_change = f"{memory_ratio:+.0%}"
+            slower = (
+                time_ratio > time_tolerance
+                and result["min_seconds"] - base["min_seconds"] > min_time_delta
+            )
+            larger = (
+                memory_ratio > memory_tolerance
+                and result["peak_kb"] - base["peak_kb"] > min_memory_delta
+            )
+            if slower or larger:
+                flag = "  REGRESSION"
+                regressions.append(name)
+        print(
+            f"{name:40} {result['seconds']:>10.5f} {result['min_seconds']:>10.5f} "
+            f"{time_change:>8} "
+            f"{result['peak_kb']:>11.1f} {memory_change:>8}{flag}"
+        )
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="10 and 100 pages only")
+    parser.add_argument("--pages", type=int, nargs="+", help="page counts to generate")
+    parser.add_argument(
+        "--layouts", nargs="+", choices=fixtures.LAYOUTS, default=fixtures.LAYOUTS
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="only run cases containing this")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--time-tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.20)
+    parser.add_argument(
+        "--min-time-delta",
+        type=float,
+        default=0.001,
+        help="seconds a case must slow down by to count as a regression",
+    )
+    parser.add_argument(
+        "--min-memory-delta",
+        type=float,
+        default=64.0,
+        help="KB a case must grow by to count as a regression",
+    )
+    parser.add_argument(
+        "--strict", action="store_true", help="exit with status 1 on regressions"
+    )
+    args = parser.parse_args(argv)
+
+    page_counts = args.pages or (QUICK_PAGE_COUNTS if args.quick else PAGE_COUNTS)
+    # Measure the code paths themselves, not cache lookups
+    cache_service.enabled = False
+
+    loop = asyncio.new_event_loop()
+    try:
+        print("Generating fixtures...")
+        extract_cases, texts = _extract_cases(loop, page_counts, args.layouts)
+        cases = extract_cases + _chunk_cases(texts) + _validation_cases()
+
+        results = {}
+        for name, fn in cases:
+            if args.filter in name:
+                results[name] = measure(fn, args.repeat)
+    finally:
+        shutdown_executor()
+        loop.close()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["cases"]
+
+    regressions = compare(
+        results,
+        baseline,
+        args.time_tolerance,
+        args.memory_tolerance,
+        args.min_time_delta,
+        args.min_memory_delta,
+    )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "environment": {
+                        "python": platform.python_version(),
+                        "pymupdf": fitz.VersionBind,
+                        "machine": platform.machine(),
+                        "processor": platform.processor(),
+                        "cpus": os.cpu_count(),
+                    },
+                    "cases": {**baseline, **results},
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} case(s) regressed beyond tolerance")
+        return 1 if args.strict else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
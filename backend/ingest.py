@@ -0,0 +1,297 @@
+"""Bulk ingestion: generate knowledge maps for every PDF under a directory
+
+Run from the repository root:
+
+    python -m backend.ingest library/                    # writes ingest.jsonl
+    python -m backend.ingest library/ -o maps.jsonl --concurrency 8
+    python -m backend.ingest library/ --summarize        # one map-reduce map per PDF
+
+Text is extracted on a process pool, one document per worker process,
+while documents already extracted have their maps generated with at most
+--concurrency Ollama generations in flight per backend. Each finished
+document is appended to the output as one JSON line, then recorded by
+content hash in the manifest (OUTPUT.manifest.jsonl). Rerunning the same
+command resumes an interrupted run: documents already processed with the
+current model and prompt version are skipped, even if they were moved or
+renamed. Generated maps also land in the result cache, so uploads of the
+same documents are served from it. Progress lines and the final summary
+report documents per minute and generated tokens per second.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List
+
+from .app.config import settings
+from .app.services.knowledge_service import PROMPT_VERSION, knowledge_service
+from .app.services.metrics_service import LLM_TOKENS
+from .app.services.ollama_service import ollama_service
+from .app.services.pdf_service import PDFService
+from .app.services.selection_service import selection_service
+from .app.utils import json_backend
+from .app.utils.resilience import CircuitOpenError
+
+HASH_READ_BYTES = 1024 * 1024
+
+
+def find_pdfs(root: str) -> Iterator[str]:
+    """PDF files under root, in a stable order"""
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield os.path.join(directory, name)
+
+
+def _hash_file(path: str) -> str:
+    """Worker entry point: SHA-256 of the file, as computed for uploads"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(HASH_READ_BYTES):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _extract_pages(path: str) -> List[str]:
+    """Worker entry point: text of every page"""
+    return list(PDFService.iter_pages(path))
+
+
+class Manifest:
+    """Append-only record of every processed document, keyed by content hash
+
+    The last line for a hash wins; a line torn by a crash is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.documents: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json_backend.loads(line)
+                    except ValueError:
+                        continue
+                    self.documents[entry["content_hash"]] = entry
+
+    def done(self, content_hash: str) -> bool:
+        entry = self.documents.get(content_hash)
+        return (
+            entry is not None
+            and entry["status"] == "completed"
+            and entry["model"] == ollama_service.model
+            and entry["prompt_version"] == PROMPT_VERSION
+        )
+
+    def record(self, entry: dict) -> None:
+        self.documents[entry["content_hash"]] = entry
+        with open(self.path, "ab") as f:
+            f.write(json_backend.dumps_bytes(entry) + b"\n")
+
+
+class Ingester:
+    """Runs every PDF through extraction, chunk selection and map generation"""
+
+    def __init__(
+        self,
+        output: str,
+        manifest: Manifest,
+        extract_workers: int,
+        documents: int,
+        summarize: bool = False,
+    ):
+        self.output = output
+        self.manifest = manifest
+        self.summarize = summarize
+        self._pool = ProcessPoolExecutor(max_workers=extract_workers)
+        # Documents held in memory at once, extracted or waiting on the LLM
+        self._slots = asyncio.Semaphore(documents)
+        # Hashes taken by this run, so duplicate files are processed once
+        self._seen = set()
+        self.total = 0
+        self.completed = 0
+        self.skipped = 0
+        self.failed = 0
+        self._start = time.perf_counter()
+        self._tokens_at_start = LLM_TOKENS.total(kind="eval")
+
+    async def run(self, paths: List[str]) -> None:
+        """Process every path; stops early only if Ollama becomes unavailable"""
+        self.total = len(paths)
+        tasks = [asyncio.create_task(self._process(path)) for path in paths]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._pool.shutdown(cancel_futures=True)
+
+    def throughput(self) -> str:
+        elapsed = time.perf_counter() - self._start
+        tokens = LLM_TOKENS.total(kind="eval") - self._tokens_at_start
+        return (
+            f"{self.completed / elapsed * 60:.1f} docs/min, "
+            f"{tokens / elapsed:.1f} tokens/s"
+        )
+
+    async def _process(self, path: str) -> None:
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            content_hash = await loop.run_in_executor(self._pool, _hash_file, path)
+            if self.manifest.done(content_hash) or content_hash in self._seen:
+                self.skipped += 1
+                print(f"Skipping {path}: already processed")
+                return
+            self._seen.add(content_hash)
+
+            start = time.perf_counter()
+            try:
+                pages, chunks, maps = await self._generate(path, content_hash)
+                if not maps:
+                    raise ValueError("No knowledge map could be generated")
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"Failed {path}: {e}")
+                self.manifest.record(self._entry(path, content_hash, "failed", 0, e))
+                return
+
+            with open(self.output, "ab") as f:
+                f.write(
+                    json_backend.dumps_bytes(
+                        {
+                            "path": path,
+                            "content_hash": content_hash,
+                            "pages": pages,
+                            "chunks": chunks,
+                            "maps": [m.model_dump() for m in maps],
+                            "seconds": round(time.perf_counter() - start, 3),
+                        }
+                    )
+                    + b"\n"
+                )
+            self.manifest.record(
+                self._entry(path, content_hash, "completed", len(maps))
+            )
+            self.completed += 1
+            done = self.completed + self.skipped + self.failed
+            print(
+                f"[{done}/{self.total}] {path}: {len(maps)} maps "
+                f"from {chunks} chunks ({self.throughput()})"
+            )
+
+    async def _generate(self, path: str, content_hash: str):
+        """Page count, chunks used and maps of one document"""
+        pages = PDFService.cached_pages(content_hash)
+        if pages is None:
+            loop = asyncio.get_running_loop()
+            pages = await loop.run_in_executor(self._pool, _extract_pages, path)
+            PDFService.cache_pages(content_hash, pages)
+
+        chunks = list(
+            PDFService.chunk_pages(pages, knowledge_service.chunk_token_budget())
+        )
+        if not chunks:
+            raise ValueError("No text content found in PDF")
+
+        if self.summarize:
+            maps = [await knowledge_service.generate_document_map(chunks)]
+        else:
+            selected = await selection_service.select(chunks, settings.MAX_CHUNKS)
+            chunks = [chunks[i] for i in selected]
+            results = await knowledge_service.generate_knowledge_maps(chunks)
+            maps = [m for m in results if m is not None]
+        return len(pages), len(chunks), maps
+
+    @staticmethod
+    def _entry(
+        path: str, content_hash: str, status: str, maps: int, error=None
+    ) -> dict:
+        return {
+            "content_hash": content_hash,
+            "path": path,
+            "status": status,
+            "maps": maps,
+            "error": str(error) if error is not None else None,
+            "model": ollama_service.model,
+            "prompt_version": PROMPT_VERSION,
+            "finished_at": datetime.utcnow().isoformat(),
+        }
+
+
+async def ingest(args: argparse.Namespace) -> int:
+    if args.concurrency:
+        for backend in ollama_service.pool.backends:
+            backend.max_in_flight = args.concurrency
+    try:
+        if not await ollama_service.check_status():
+            print("Ollama is not available, nothing was processed")
+            return 1
+
+        paths = list(find_pdfs(args.directory))
+        manifest = Manifest(args.manifest or f"{args.output}.manifest.jsonl")
+        print(f"Found {len(paths)} PDFs, {len(manifest.documents)} in the manifest")
+        ingester = Ingester(
+            args.output,
+            manifest,
+            args.extract_workers,
+            args.documents,
+            args.summarize,
+        )
+        try:
+            await ingester.run(paths)
+        except CircuitOpenError:
+            print("Ollama became unavailable; rerun the command to resume")
+            return 1
+        finally:
+            print(
+                f"Completed {ingester.completed}, skipped {ingester.skipped}, "
+                f"failed {ingester.failed} of {len(paths)} "
+                f"({ingester.throughput()})"
+            )
+        return 1 if ingester.failed else 0
+    finally:
+        await ollama_service.close()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="directory searched recursively for PDFs")
+    parser.add_argument("-o", "--output", default="ingest.jsonl")
+    parser.add_argument(
+        "--manifest", help="checkpoint file, default OUTPUT.manifest.jsonl"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Ollama generations in flight per backend, default LLM_MAX_CONCURRENCY",
+    )
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="extraction processes",
+    )
+    parser.add_argument(
+        "--documents", type=int, default=8, help="documents in progress at once"
+    )
+    parser.add_argument(
+        "--summarize",
+        action="store_true",
+        help="summarize each whole document into one map",
+    )
+    args = parser.parse_args(argv)
+    return asyncio.run(ingest(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,27 @@
+import time
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from .app.config import settings
-from .app.routers import health, questions, upload
-from .app.services.ollama_service import check_ollama_status, preload_model
+from .app.routers import documents, health, jobs, questions, upload
+from .app.services.job_service import job_queue
+from .app.services.map_pager import map_pager
+from .app.services.metrics_service import REQUEST_SECONDS
+from .app.services.ollama_service import ollama_service
+from .app.services.pdf_service import shutdown_executor
+from .app.services.question_bank import question_bank
+from .app.services.shared_state import shared_state
+from .app.utils.json_backend import use_orjson
+from .app.utils.resilience import CircuitOpenError
 
 app = FastAPI(
     title="Readly  API",
     version="1.0.0",
     description="AI-powered knowledge map generation from PDF documents",
+    default_response_class=ORJSONResponse if use_orjson else JSONResponse,
 )
 
 # Add CORS middleware
@@ -25,6 +37,42 @@ app.add_middleware(
 app.include_router(upload.router, prefix="/api/v1", tags=["upload"])
 app.include_router(questions.router, prefix="/api/v1", tags=["questions"])
 app.include_router(health.router, prefix="/api/v1", tags=["health"])
+app.include_router(jobs.router, prefix="/api/v1", tags=["jobs"])
+app.include_router(documents.router, prefix="/api/v1", tags=["documents"])
+
+
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    """Time every request by its route template, up to when the response starts"""
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start_time,
+        method=request.method,
+        route=_route_template(request),
+        status=response.status_code,
+    )
+    return response
+
+
+def _route_template(request: Request) -> str:
+    """Request path with path parameters put back as {name}, to bound label values"""
+    if "route" not in request.scope:
+        return "unmatched"
+    path = request.url.path
+    for name, value in request.path_params.items():
+        path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+    return path
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    """Fail fast while Ollama is down instead of waiting on timeouts"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Ollama is unavailable, try again later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 @app.get("/")
@@ -36,7 +84,11 @@ async def root():
         "docs_url": "/docs",
         "endpoints": {
             "upload": "POST /api/v1/upload - Upload PDF file",
+            "upload-stream": "POST /api/v1/upload/stream - Upload PDF file and stream maps as NDJSON",
+            "jobs": "GET/DELETE /api/v1/jobs/{job_id} - Poll or cancel a background upload",
+            "document-maps": "GET /api/v1/documents/{document_id}/maps - Page through maps of every chunk, generated on demand",
             "generate-questions": "POST /api/v1/generate-questions - Generate additional questions",
+            "generate-questions-batch": "POST /api/v1/generate-questions/batch - Generate questions for many subtopics at once",
             "test-ollama": "GET /api/v1/test-ollama - Test Ollama connection",
         },
     }
@@ -46,25 +98,34 @@ async def root():
 async def startup_event():
     """Initialize the application on startup"""
     print("Starting FastAPI server...")
-    print("Checking Ollama status...")
+    shared_state.start()
+    job_queue.start()
+    # Status check and preload run in the background so requests are served
+    # immediately; health reports "warming" until they finish
+    ollama_service.start_warmup()
+    ollama_service.start_prober()
 
-    if not check_ollama_status():
-        print("Warning: Ollama is not accessible")
-        print("Make sure Ollama is running: ollama serve")
-        print("And Mistral model is installed: ollama pull mistral")
 
-    print("Preloading model...")
-    if preload_model():
-        print("Server ready!")
-    else:
-        print("Failed to preload model - please check Ollama")
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop job workers and release Ollama connections and extraction workers"""
+    await job_queue.stop()
+    await question_bank.stop()
+    await map_pager.stop()
+    await ollama_service.stop_warmup()
+    await ollama_service.stop_prober()
+    await ollama_service.close()
+    await shared_state.stop()
+    shutdown_executor()
 
 
 if __name__ == "__main__":
+    # Reload runs a single process, so it is only used without extra workers
     uvicorn.run(
         "main:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG,
+        reload=settings.DEBUG and settings.WORKERS == 1,
+        workers=settings.WORKERS,
         log_level="info",
     )
@@ -27,19 +27,21 @@ export default function FileUploader() {
         const stored = localStorage.getItem("knowledgeMaps");
         const currentMaps = stored ? JSON.parse(stored) : [];
 
-        const updatedMaps = currentMaps.map((mapStr) => {
+        const updatedMaps = currentMaps.map((stored) => {
           let map;
           try {
-            map = JSON.parse(mapStr);
+            // Older sessions stored each map as a JSON string
+            map = typeof stored === "string" ? JSON.parse(stored) : stored;
           } catch {
-            return mapStr;
+            return stored;
           }
 
-          map.subtopics = map.subtopics.map((sub) =>
-            sub.title === updatedSubtopic.title ? updatedSubtopic : sub
-          );
-
-          return JSON.stringify(map);
+          return {
+            ...map,
+            subtopics: map.subtopics.map((sub) =>
+              sub.title === updatedSubtopic.title ? updatedSubtopic : sub
+            ),
+          };
         });
 
         setMaps(updatedMaps);
@@ -104,8 +106,8 @@ export default function FileUploader() {
           {maps.map((map, i) => {
             let parsed;
             try {
-              parsed = JSON.parse(map); // parses the JSON knowledge map
-              console.log("Parsed map:", parsed);
+              // Maps arrive as objects; older sessions stored JSON strings
+              parsed = typeof map === "string" ? JSON.parse(map) : map;
             } catch (e) {
               return <p className="text-red-500">Invalid map data</p>;
             }